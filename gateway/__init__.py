@@ -84,7 +84,7 @@ class Gateway:
             iface = network.WLAN(network.AP_IF)
             iface.active(True)
         else:
-            iface = self.client._sta_if
+            iface = self.client._transport.nic
         self.gwid = bytes.hex(iface.config('mac'))
         self.iface = iface
         print(f"ESPNow ID: {self.gwid}")
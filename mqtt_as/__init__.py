@@ -10,25 +10,33 @@
 # 32720
 # 32896 with f-strings
 import gc
-import socket
-import struct
-import time
+from array import array
+from sys import platform, implementation
+
+# Host mode: under CPython stand-ins for MicroPython modules are installed.
+HOST = implementation.name != "micropython"
+if HOST:
+    from .host import socket, StreamReader
+else:
+    import socket
 
 gc.collect()
 from binascii import hexlify
 import asyncio
 
+if not HOST:
+    StreamReader = asyncio.StreamReader
+
 gc.collect()
-from time import ticks_ms, ticks_diff
+from time import ticks_ms, ticks_us, ticks_diff
 from errno import EINPROGRESS, ETIMEDOUT
 
 gc.collect()
 from micropython import const
 from machine import unique_id
-import network
 
 gc.collect()
-from sys import platform
+from .codec import vbi, encode, encoded_size, encode_connect, connect_size, Parser  # noqa: F401
 
 VERSION = (0, 8, 3)
 # Default initial size for input messge buffer. Increase this if large messages
@@ -37,6 +45,21 @@ IBUFSIZE = 50
 # By default the callback interface returns and incoming message as bytes.
 # For performance reasons with large messages it may return a memoryview.
 MSG_BYTES = True
+# Maximum size of a decompressed incoming message (MQTTv5 only).
+ZBUFSIZE = 1024
+# In low power mode, interval between checks on WiFi status and RAM (ms).
+LP_CHECK_MS = 10_000
+# Maximum age of the cached link state (ms). I/O loops check the link on every
+# chunk: querying the driver each time is costly for long messages.
+LINK_MS = 100
+# Outgoing packets are coalesced in a buffer of this size. Larger items are
+# written directly from the caller's buffer.
+OBUFSIZE = 128
+# Maximum number of outgoing packets queued. Senders wait when it is full.
+OQLEN = 8
+# The client collects garbage when free RAM falls below this percentage of the
+# heap. MicroPython also collects whenever an allocation fails.
+GC_FREE = 25
 
 # Legitimate errors while waiting on a socket. See uasyncio __init__.py open_connection().
 ESP32 = platform == "esp32"
@@ -87,6 +110,97 @@ class MsgQueue:
         return r
 
 
+# Outgoing packet queue. Packets are written in order by a single task. Each
+# packet has a ticket number which senders use to await its transmission.
+# Tickets wrap, and are compared in the manner of ticks_diff. The ready Event
+# may be shared by several queues serviced by the same task. Fields of each
+# packet are stored in preallocated slots, so queueing does not allocate.
+_TMASK = const(0xFFFFF)
+# ssl_params keys supported with SSLContext: those of MicroPython's wrap_socket.
+_SSL_KEYS = ("key", "cert", "server_side", "server_hostname", "do_handshake", "cert_reqs", "cadata")
+
+
+class PktQueue:
+    def __init__(self, size, ready):
+        self.hdr = bytearray(size)
+        self.pid = array("H", bytes(2 * size))
+        self.topic = [None] * size
+        self.msg = [None] * size
+        self.props = [None] * size
+        self._size = size
+        self._wi = 0
+        self._ri = 0
+        self._n = 0  # No. of packets queued
+        self.seq = 0  # Ticket of latest packet queued
+        self.done = 0  # Ticket of latest packet written
+        self.unsent = 0  # Packets removed by the writer but not yet written
+        self.epoch = 0  # Incremented when queue is discarded
+        self.open = False  # A writer task is running
+        self.ready = ready  # Set when a packet is queued
+        self._evt = asyncio.Event()  # Pulsed on progress
+
+    def _pulse(self):  # Wake all tasks waiting on progress
+        self._evt.set()
+        self._evt.clear()
+
+    # Queue a packet. Return its ticket. Waits if the queue is full.
+    async def put(self, hdr, pid, topic, msg, props):
+        while self.open and self._n >= self._size:
+            await self._evt.wait()
+        if not self.open:
+            raise OSError(-1, "Not connected")
+        i = self._wi
+        self.hdr[i] = hdr
+        self.pid[i] = pid
+        self.topic[i] = topic
+        self.msg[i] = msg
+        self.props[i] = props
+        self._wi = (i + 1) % self._size
+        self._n += 1
+        self.seq = (self.seq + 1) & _TMASK
+        self.ready.set()
+        return self.seq
+
+    # Wait until the packet with a given ticket has been written. Raises
+    # OSError if the queue was discarded first.
+    async def wait(self, ticket, epoch):
+        while self.epoch == epoch:
+            if (self.done - ticket) & _TMASK < _TMASK >> 1:
+                return
+            await self._evt.wait()
+        raise OSError(-1, "Packet discarded")
+
+    # Called by the writer. Return the slot of the oldest packet, or -1 if
+    # empty. The slot is not reused until the writer calls .pop().
+    def peek(self):
+        return self._ri if self._n else -1
+
+    def pop(self):  # The writer has encoded the oldest packet.
+        self._clear(self._ri)
+        self._ri = (self._ri + 1) % self._size
+        self._n -= 1
+
+    def _clear(self, i):  # Release references to caller's buffers
+        self.topic[i] = None
+        self.msg[i] = None
+        self.props[i] = None
+
+    def written(self):  # The writer has written all packets it removed.
+        if self.unsent:
+            self.done = (self.done + self.unsent) & _TMASK
+            self.unsent = 0
+            self._pulse()
+
+    def discard(self):  # Writer has quit: fail all waiting senders.
+        self.open = False
+        for i in range(self._size):
+            self._clear(i)
+        self._wi = self._ri = self._n = self.unsent = 0
+        self.done = self.seq
+        self.epoch += 1
+        self._pulse()
+
+
 config = {
     "client_id": hexlify(unique_id()),
     "server": None,
@@ -98,6 +212,9 @@ config = {
     "ssl": False,
     "ssl_params": {},
     "response_time": 10,
+    "rto_min": 0.5,
+    "rto_max": 0,
+    "tls_timeout": 0,
     "clean_init": True,
     "clean": True,
     "max_repubs": 4,
@@ -105,10 +222,21 @@ config = {
     "subs_cb": lambda *_: None,
     "wifi_coro": eliza,
     "connect_coro": eliza,
+    "dns_server": None,
     "ssid": None,
     "wifi_pw": None,
     "queue_len": 0,
+    "low_power": False,
+    "static_mem": False,
+    "ibuf_size": 0,
+    "obuf_size": 0,
+    "rate_limits": None,
+    "compress": None,
+    "journal": None,
+    "dup_cache": 0,
     "gateway": False,
+    "transport": None,
+    "lag_monitor": 0,
     "mqttv5": False,
     "mqttv5_con_props": None,
 }
@@ -130,18 +258,9 @@ def qos_check(qos):
         raise ValueError("Only qos 0 and 1 are supported.")
 
 
-# Populate a byte array with a variable byte integer. Args: buf the bytearray,
-# offs: start offset. x the value. Returns the end offset.
-# 1-4 bytes allowed, encoding up to 268,435,455 (V3.1.1 table 2.4). No point trapping this.
-def vbi(buf: bytearray, offs: int, x: int):
-    buf[offs] = x & 0x7F
-    if x := x >> 7:
-        buf[offs] |= 0x80
-    return vbi(buf, offs + 1, x) if x else (offs + 1)
-
-
 encode_properties = None
 decode_properties = None
+decode_vbi = None
 
 
 class MQTT_base:
@@ -157,7 +276,15 @@ class MQTT_base:
         self._keepalive = config["keepalive"]
         if self._keepalive >= 65536:
             raise ValueError("invalid keepalive time")
-        self._response_time = config["response_time"] * 1000  # Repub if no PUBACK received (ms).
+        self._p_i = config["ping_interval"] * 1000  # Can specify shorter e.g. for subscribe-only
+        self._set_keepalive(self._keepalive)
+        self._response_time = config["response_time"] * 1000  # Read/write timeout (ms).
+        # Retransmission timeout (ms) adapts to the measured broker round trip time.
+        self._rto_min = int(config["rto_min"] * 1000)
+        self._rto_max = int(config["rto_max"] * 1000) or self._response_time
+        self._rto = self._rto_max  # Until a round trip has been measured
+        self._srtt = None  # Smoothed round trip time (ms)
+        self._rttvar = 0
         self._max_repubs = config["max_repubs"]
         self._clean_init = config["clean_init"]  # clean_session state on first connection
         self._clean = config["clean"]  # clean_session state on reconnect
@@ -171,6 +298,11 @@ class MQTT_base:
         self._wifi_pw = config["wifi_pw"]
         self._ssl = config["ssl"]
         self._ssl_params = config["ssl_params"]
+        self._tls_timeout = int(config["tls_timeout"] * 1000) or self._response_time
+        self._ssl_ctx = None  # SSLContext is created on first connection.
+        self._ssl_session = None  # Session for resumption (where supported).
+        self._tap = None  # Called with each new connection's stream to log traffic
+        self.metrics = {}  # Performance data populated by the client.
         # Callbacks and coros
         if self._events:
             self.up = asyncio.Event()
@@ -188,33 +320,88 @@ class MQTT_base:
         self.server = config["server"]
         if self.server is None:
             raise ValueError("no server specified.")
+        self._low_power = config["low_power"]
+        if self._low_power:
+            self._linkdown = asyncio.Event()  # Wakes ._keep_connected()
         self._sock = None
-        self._sta_if = network.WLAN(network.STA_IF)
-        self._sta_if.active(True)
-        if config["gateway"]:  # Called from gateway (hence ESP32).
-            import aioespnow  # Set up ESPNOW
-
-            while not (sta := self._sta_if).active():
-                time.sleep(0.1)
-            sta.config(pm=sta.PM_NONE)  # No power management
-            sta.active(True)
-            self._espnow = aioespnow.AIOESPNow()  # Returns AIOESPNow enhanced with async support
-            self._espnow.active(True)
+        self._addr = None  # Broker socket address
+        self._dns = config["dns_server"]  # None: use server provided by DHCP
+        # Numeric addresses need no lookup. Resolver is created on first connect.
+        self._resolver = None if self.server.strip("0123456789.") else False
+        # Link to the broker. See transport.py.
+        if (transport := config["transport"]) is None:
+            from .transport import Socket, WiFi
+
+            transport = Socket() if HOST else WiFi()  # The host OS manages its network
+        self._transport = transport
+        if config["gateway"]:  # Called from gateway (hence ESP32 and WiFi).
+            from .wifi import espnow  # Set up ESPNOW
+
+            self._espnow = espnow(transport.nic)
 
         self.newpid = pid_gen()
         self.rcv_pids = set()  # PUBACK and SUBACK pids awaiting ACK response
+        # qos==1 publications awaiting PUBACK, in order of publication. Entries
+        # survive a reconnection: if the broker has retained the session they
+        # are resent with their original PID.
+        self._inflight = []
+        self._session = False  # Broker has retained session state
+        # Ring of PIDs of recently received qos==1 publications: redeliveries
+        # of these are acknowledged but not passed to the application.
+        self._dups = None
+        if n := config["dup_cache"]:
+            self._dups = array("H", bytes(2 * n))  # PID 0 is never used
+            self._dupix = 0
+        self._ackevts = {}  # {pid: Event} Set when the ACK for pid is received
         self.last_rx = ticks_ms()  # Time of last communication from broker
-        self.lock = asyncio.Lock()
-        self._ibuf = bytearray(IBUFSIZE)
-        self._mvbuf = memoryview(self._ibuf)
+        self.last_tx = self.last_rx  # Time of last communication to broker
+        self.lock = asyncio.Lock()  # Protects the parser and its input buffer
+        # Outgoing packets are queued and written by a single task. Buffers
+        # are allocated here to avoid allocation at runtime. Queues are in
+        # priority order: control packets, qos==1 and qos==0 publications.
+        self._txready = asyncio.Event()
+        self._txq = tuple(PktQueue(OQLEN, self._txready) for _ in range(3))
+        self._txbuf = bytearray(max(config["obuf_size"] or OBUFSIZE, 16))
+        self._txn = 0  # Bytes in ._txbuf
+        # Static mode: pass incoming topic and message as memoryviews.
+        self._static = config["static_mem"] and not self._events
+        self._shaper = None
+        if limits := config["rate_limits"]:  # Publication rate limits
+            from .shaper import Shaper
+
+            self._shaper = Shaper(limits)
 
         self.mqttv5 = config.get("mqttv5")
         self.mqttv5_con_props = config.get("mqttv5_con_props")
         self.topic_alias_maximum = 0
 
         if self.mqttv5:
-            global encode_properties, decode_properties
+            global encode_properties, decode_properties, decode_vbi
             from .mqtt_v5_properties import encode_properties, decode_properties  # noqa
+            from .mqtt_v5_properties import decode_variable_byte_int as decode_vbi  # noqa
+        # Incoming packets are parsed into events. See codec.py.
+        self._parser = Parser(self.mqttv5, config["ibuf_size"] or IBUFSIZE)
+
+        self._zpolicy = None  # Payload compression
+        self._zbuf = None  # Allocated on receipt of a compressed message
+        if ztopics := config["compress"]:
+            if not self.mqttv5:
+                raise ValueError("compression requires MQTTv5.")
+            from .compress import Policy
+
+            self._zpolicy = Policy(ztopics)
+
+        self._journal = None  # Flash journal of qos==1 publications
+        if fname := config["journal"]:
+            from .journal import Journal
+
+            self._journal = Journal(fname)
+
+        self.lag = None  # Scheduler lag monitor
+        if period := config["lag_monitor"]:
+            from .lag import Monitor
+
+            self.lag = Monitor(self.metrics, period)
 
     def _set_last_will(self, topic, msg, retain=False, qos=0):
         qos_check(qos)
@@ -225,6 +412,13 @@ class MQTT_base:
         self._lw_qos = qos
         self._lw_retain = retain
 
+    # Set the ping interval (ms) from a keepalive time (s).
+    def _set_keepalive(self, keepalive):
+        pi = keepalive * 250 if keepalive else 20000
+        if self._p_i and self._p_i < pi:
+            pi = self._p_i
+        self._ping_interval = pi
+
     def dprint(self, msg, *args):
         if self.DEBUG:
             print(msg % args)
@@ -232,23 +426,19 @@ class MQTT_base:
     def _timeout(self, t):
         return ticks_diff(ticks_ms(), t) > self._response_time
 
-    async def _as_read(self, n, sock=None):  # OSError caught by superclass
+    # Read len(buf) bytes into buf, typically a memoryview supplied by the
+    # parser. Allocation only occurs if the data arrives in more than one chunk.
+    async def _as_readinto(self, buf, sock=None):
         if sock is None:
             sock = self._sock
-        # Ensure input buffer is big enough to hold data. It keeps the new size
-        oflow = n - len(self._ibuf)
-        if oflow > 0:  # Grow the buffer and re-create the memoryview
-            # Avoid too frequent small allocations by adding some extra bytes
-            self._ibuf.extend(bytearray(oflow + 50))
-            self._mvbuf = memoryview(self._ibuf)
-        buffer = self._mvbuf
+        n = len(buf)
         size = 0
         t = ticks_ms()
         while size < n:
             if self._timeout(t) or not self.isconnected():
                 raise OSError(-1, "Timeout on socket read")
             try:
-                msg_size = sock.readinto(buffer[size:], n - size)
+                msg_size = sock.readinto(buf[size:] if size else buf, n - size)
             except OSError as e:  # ESP32 issues weird 119 errors here
                 msg_size = None
                 if e.args[0] not in BUSY_ERRORS:
@@ -260,164 +450,211 @@ class MQTT_base:
                 t = ticks_ms()
                 self.last_rx = ticks_ms()
             await asyncio.sleep_ms(0)
-        return buffer[:n]
 
-    async def _as_write(self, bytes_wr, length=0, sock=None):
+    # Write length bytes of buf (0: all of it). The stream write method's
+    # offset arg avoids slicing, hence allocation, on partial writes.
+    async def _as_write(self, buf, length=0, sock=None):
         if sock is None:
             sock = self._sock
-
-        # Wrap bytes in memoryview to avoid copying during slicing
-        bytes_wr = memoryview(bytes_wr)
-        if length:
-            bytes_wr = bytes_wr[:length]
+        if not length:
+            length = len(buf)
+        offs = 0
         t = ticks_ms()
-        while bytes_wr:
+        while offs < length:
             if self._timeout(t) or not self.isconnected():
                 raise OSError(-1, "Timeout on socket write")
             try:
-                n = sock.write(bytes_wr)
+                n = sock.write(buf, offs, length - offs)
             except OSError as e:  # ESP32 issues weird 119 errors here
                 n = 0
                 if e.args[0] not in BUSY_ERRORS:
                     raise
             if n:
                 t = ticks_ms()
-                bytes_wr = bytes_wr[n:]
+                self.last_tx = t
+                offs += n
             await asyncio.sleep_ms(0)
 
-    async def _send_str(self, s):
-        await self._as_write(struct.pack("!H", len(s)))
-        await self._as_write(s)
-
-    # Receive a Variable Byte Integer and decode.
-    async def _recv_len(self, d=0, i=0):
-        s = (await self._as_read(1))[0]
-        d |= (s & 0x7F) << (i * 7)
-        return await self._recv_len(d, i + 1) if (s & 0x80) else (d, i + 1)
+    # Read the remainder of the packet being parsed. Return its event.
+    async def _recv(self):
+        p = self._parser
+        while True:
+            mv = p.want()
+            await self._as_readinto(mv)
+            if (ev := p.got(len(mv))) is not None:
+                return ev
 
     async def _connect(self, clean):
         mqttv5 = self.mqttv5  # Cache local
-        self._sock = socket.socket()
-        self._sock.setblocking(False)
-        try:
-            self._sock.connect(self._addr)
-        except OSError as e:
-            if e.args[0] not in BUSY_ERRORS:
-                raise
+        self._set_keepalive(self._keepalive)  # May be overridden by V5 broker
+        self._sock = self._transport.open(self._addr)
         await asyncio.sleep_ms(0)
         self.dprint("Connecting to broker.")
-        if self._ssl:
-            try:
-                import ssl
-            except ImportError:
-                import ussl as ssl
-
-            self._sock = ssl.wrap_socket(self._sock, **self._ssl_params)
-        premsg = bytearray(b"\x10\0\0\0\0\0")
-        msg = bytearray(b"\x04MQTT\x00\0\0\0")
-        msg[5] = 0x05 if mqttv5 else 0x04
-
-        sz = 10 + 2 + len(self._client_id)
-        msg[6] = clean << 1
-        if self._user:
-            sz += 2 + len(self._user) + 2 + len(self._pswd)
-            msg[6] |= 0xC0
-        if self._keepalive:
-            msg[7] |= self._keepalive >> 8
-            msg[8] |= self._keepalive & 0x00FF
-        if self._lw_topic:
-            sz += 2 + len(self._lw_topic) + 2 + len(self._lw_msg)
-            if mqttv5:
-                # Extra for the will properties
-                sz += 1
-            msg[6] |= 0x4 | (self._lw_qos & 0x1) << 3 | (self._lw_qos & 0x2) << 3
-            msg[6] |= self._lw_retain << 5
-
-        if mqttv5:
-            properties = encode_properties(self.mqttv5_con_props)
-            sz += len(properties)
-
-        i = vbi(premsg, 1, sz)  # sz -> Variable Byte Integer
-        await self._as_write(premsg, i + 1)
-        await self._as_write(msg)
-        if mqttv5:
-            await self._as_write(properties)
-
-        await self._send_str(self._client_id)
-        if self._lw_topic:
-            if mqttv5:
-                # We don't support will properties, so we send 0x00 for properties length
-                await self._as_write(b"\x00")
-            await self._send_str(self._lw_topic)
-            await self._send_str(self._lw_msg)
-        if self._user:
-            await self._send_str(self._user)
-            await self._send_str(self._pswd)
+        will = (self._lw_topic, self._lw_msg, self._lw_retain, self._lw_qos) if self._lw_topic else None
+        # We don't support will properties: an empty set is sent.
+        props = encode_properties(self.mqttv5_con_props) if mqttv5 else None
+        args = (self._client_id, self._user, self._pswd, will, props)
+        pkt = bytearray(connect_size(*args))
+        encode_connect(pkt, 0, clean, self._keepalive, *args)
+        del args, props
+        n = await self._tls(pkt) if self._ssl else 0  # Bytes written by handshake
+        if self._tap is not None:  # Log traffic: see capture.py
+            self._sock = self._tap(self._sock, pkt[:n])
+        await self._as_write(memoryview(pkt)[n:])
+        del pkt
         # Await CONNACK
         # read causes ECONNABORTED if broker is out; triggers a reconnect.
-        del premsg, msg
-        packet_type = await self._as_read(1)
-        if packet_type[0] != 0x20:
+        self._parser.reset()
+        ev = await self._recv()
+        if ev[0] != 0x20:
             raise OSError(-1, "CONNACK not received")
-        # The connect packet has changed, so size might be different now. But
-        # we can still handle it the same for 3.1.1 and v5
-        sz, _ = await self._recv_len()
-        if not mqttv5 and sz != 2:
-            raise OSError(-1, "Invalid CONNACK packet")
-
-        # Only read the first 2 bytes, as properties have their own length
-        connack_resp = await self._as_read(2)
-
-        # Connect ack flags
-        if connack_resp[0] != 0:
-            raise OSError(-1, "CONNACK flags not 0")
-        # Reason code
-        if connack_resp[1] != 0:
+        _, session, reason, props = ev
+        if reason:
             # On MQTTv5 Reason codes below 128 may need to be handled
             # differently. For now, we just raise an error. Spec is a bit weird
             # on this.
-            raise OSError(-1, "CONNACK reason code 0x%x" % connack_resp[1])
-
-        del connack_resp
-        if not mqttv5:
-            # If we are not on MQTTv5 we can stop here
+            raise OSError(-1, "CONNACK reason code 0x%x" % reason)
+        self._session = session  # Session Present
+        if props is not None:  # MQTTv5
+            self.dprint("CONNACK properties: %s", props)
+            self.topic_alias_maximum = props.get(0x22, 0)
+            if 0x13 in props:  # Server Keep Alive overrides ours
+                self._set_keepalive(props[0x13])
+
+    # Wrap the socket for TLS. The SSLContext is created once so certificates
+    # are only parsed on the first connection. The handshake is non-blocking.
+    # Sockets lacking .do_handshake() (MicroPython) perform it on the first
+    # write: this is driven by writing the first byte of the CONNECT packet.
+    # The handshake times out after config["tls_timeout"]. Returns the number
+    # of bytes of the packet written.
+    async def _tls(self, premsg):
+        if HOST:
+            from .host import ssl
+        else:
+            try:
+                import ssl
+            except ImportError:
+                import ussl as ssl
+        p = self._ssl_params
+        t = ticks_ms()
+        metrics = self.metrics
+        if not hasattr(ssl, "SSLContext"):  # Old firmware: handshake blocks.
+            self._sock = ssl.wrap_socket(self._sock, **p)
+            metrics["tls_hs_ms"] = metrics["tls_hs_cpu_ms"] = ticks_diff(ticks_ms(), t)
+            return 0
+        if (ctx := self._ssl_ctx) is None:
+            for k in p:
+                if k not in _SSL_KEYS:
+                    raise ValueError(f"ssl_params key '{k}' is not supported.")
+            ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER if p.get("server_side") else ssl.PROTOCOL_TLS_CLIENT)
+            if hasattr(ctx, "check_hostname"):  # CPython
+                ctx.check_hostname = False
+            ctx.verify_mode = p.get("cert_reqs", ssl.CERT_NONE)
+            if "cert" in p or "key" in p:
+                ctx.load_cert_chain(p.get("cert"), p.get("key"))
+            if "cadata" in p:
+                ctx.load_verify_locations(cadata=p["cadata"])
+            self._ssl_ctx = ctx
+            # CPython raises these where MicroPython returns None.
+            self._ssl_busy = tuple(getattr(ssl, e) for e in ("SSLWantReadError", "SSLWantWriteError") if hasattr(ssl, e))
+        kw = {"server_hostname": p.get("server_hostname"), "do_handshake_on_connect": False}
+        if self._ssl_session is not None:
+            kw["session"] = self._ssl_session
+        sock = ctx.wrap_socket(self._sock, **kw)
+        self._sock = sock
+        hs = getattr(sock, "do_handshake", None)
+        cpu = 0  # Time spent in the TLS library (us)
+        while True:
+            if ticks_diff(ticks_ms(), t) > self._tls_timeout or not self.isconnected():
+                raise OSError(-1, "TLS handshake timeout")
+            t0 = ticks_us()
+            try:
+                n = sock.write(premsg[:1]) if hs is None else hs() or 0
+            except OSError as e:
+                n = None
+                if e.args[0] not in BUSY_ERRORS and not isinstance(e, self._ssl_busy):
+                    raise
+            t0 = ticks_diff(ticks_us(), t0)
+            cpu += t0
+            if self.lag is not None:
+                self.lag.record("tls", t0)
+            if n is not None:
+                break
+            await asyncio.sleep_ms(0)
+        metrics["tls_hs_ms"] = ticks_diff(ticks_ms(), t)
+        metrics["tls_hs_cpu_ms"] = cpu // 1000
+        if getattr(sock, "session_reused", False):
+            metrics["tls_resumed"] = metrics.get("tls_resumed", 0) + 1
+        return n
+
+    # Queue a packet for the writer task. Unless wait is False, wait until it
+    # has been written: the caller's buffers may then be reused. OSError is
+    # raised if the link fails first.
+    async def _send(self, hdr, pid=0, topic=None, msg=None, props=None, wait=True):
+        if hdr & 0xF0 != 0x30:  # Control packet
+            q = self._txq[0]
+        else:
+            q = self._txq[1 if hdr & 6 else 2]
+        ticket = await q.put(hdr, pid, topic, msg, props)
+        if wait:
+            await q.wait(ticket, q.epoch)
+
+    # Write any queued packets, coalescing them into as few socket writes as
+    # possible. Called by the writer task. After each packet the highest
+    # priority queue is serviced first, so a burst of publications cannot
+    # delay a ping or acknowledgement by more than one packet.
+    async def _write_queue(self):
+        while True:
+            for q in self._txq:
+                if (i := q.peek()) >= 0:
+                    break
+            else:  # All queues empty
+                break
+            await self._encode(q.hdr[i], q.pid[i], q.topic[i], q.msg[i], q.props[i])
+            q.pop()
+            q.unsent += 1
+        await self._flush()
+
+    # Encode a packet into the output buffer. pid == 0 signifies no PID,
+    # props is None for MQTT V3.1.1. For SUBSCRIBE msg holds the qos.
+    async def _encode(self, hdr, pid, topic, msg, props):
+        if HOST:  # CPython str has no buffer protocol
+            topic = topic.encode() if isinstance(topic, str) else topic
+            msg = msg.encode() if isinstance(msg, str) else msg
+        buf = self._txbuf
+        n = encoded_size(hdr, pid, topic, msg, props)
+        if n > len(buf) - self._txn:
+            await self._flush()
+        if n <= len(buf):
+            self._txn = encode(buf, self._txn, hdr, pid, topic, msg, props)
             return
-
-        connack_props_length, _ = await self._recv_len()
-        if connack_props_length > 0:
-            connack_props = await self._as_read(connack_props_length)
-            decoded_props = decode_properties(connack_props, connack_props_length)
-            self.dprint("CONNACK properties: %s", decoded_props)
-            self.topic_alias_maximum = decoded_props.get(0x22, 0)
+        # Too large for the buffer. A PUBLISH payload is written directly
+        # from the caller's buffer; a header which does not fit is allocated.
+        if pub := hdr & 0xF0 == 0x30:
+            n -= len(msg)
+        b = buf if n <= len(buf) else bytearray(n)
+        await self._as_write(b, encode(b, 0, hdr, pid, topic, msg, props, False))
+        if pub:
+            await self._as_write(msg)
+
+    # Write the output buffer. Packets encoded in full are then complete.
+    async def _flush(self):
+        if self._txn:
+            n = self._txn
+            self._txn = 0
+            await self._as_write(self._txbuf, n)
+        for q in self._txq:
+            q.written()
 
     async def _ping(self):
-        async with self.lock:
-            await self._as_write(b"\xc0\0")
+        await self._send(0xC0)
+        self.metrics["pings"] = self.metrics.get("pings", 0) + 1
 
     # Check internet connectivity by sending DNS lookup to Google's 8.8.8.8
-    async def wan_ok(
-        self,
-        packet=b"$\x1a\x01\x00\x00\x01\x00\x00\x00\x00\x00\x00\x03www\x06google\x03com\x00\x00\x01\x00\x01",
-    ):
-        if not self.isconnected():  # WiFi is down
-            return False
-        length = 32  # DNS query and response packet size
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.setblocking(False)
-        s.connect(("8.8.8.8", 53))
-        await asyncio.sleep(1)
-        async with self.lock:
-            try:
-                await self._as_write(packet, sock=s)
-                await asyncio.sleep(2)
-                res = await self._as_read(length, s)
-                if len(res) == length:
-                    return True  # DNS response size OK
-            except OSError:  # Timeout on read: no connectivity.
-                return False
-            finally:
-                s.close()
-        return False
+    async def wan_ok(self, packet=None):
+        from .diag import wan_ok
+
+        return await wan_ok(self, packet)
 
     async def broker_up(self):  # Test broker connectivity
         if not self.isconnected():
@@ -447,72 +684,115 @@ class MQTT_base:
                 pass
             self._close()
         self._has_connected = False
+        if self._low_power:
+            self._linkdown.set()  # ._keep_connected() quits
 
     def _close(self):
         if self._sock is not None:
+            if self._ssl_ctx is not None:  # Retain any TLS session for resumption.
+                self._ssl_session = getattr(self._sock, "session", None) or self._ssl_session
             self._sock.close()
 
     def close(self):  # API. See https://github.com/peterhinch/micropython-mqtt/issues/60
         self._close()
         try:
-            self._sta_if.disconnect()  # Disconnect Wi-Fi to avoid errors
+            self._transport.close()
         except OSError:
             self.dprint("Wi-Fi not started, unable to disconnect interface")
-        self._sta_if.active(False)
 
-    async def _await_pid(self, pid):
+    # Wait for an ACK for up to the retransmission timeout. If sample is True
+    # the round trip time updates the RTO. Karn's algorithm: retransmitted
+    # packets are not sampled because the ACK may be for either transmission.
+    # The Event is created before the pid is checked and stays set, so an ACK
+    # arriving before the wait starts is not missed. Only an ACK which set it
+    # gives an RTT sample.
+    async def _await_pid(self, pid, sample=True):
         t = ticks_ms()
-        while pid in self.rcv_pids:  # local copy
-            if self._timeout(t) or not self.isconnected():
-                break  # Must repub or bail out
-            await asyncio.sleep_ms(100)
+        self._ackevts[pid] = evt = asyncio.Event()
+        try:
+            while pid in self.rcv_pids:  # local copy
+                if not self.isconnected():
+                    return False  # Bail out
+                if (dt := self._rto - ticks_diff(ticks_ms(), t)) <= 0:
+                    # Must repub. Back off until an RTT is measured.
+                    self._rto = min(self._rto * 2, self._rto_max)
+                    self.metrics["rto_ms"] = self._rto
+                    return False
+                try:  # Wake periodically to check connectivity
+                    await asyncio.wait_for_ms(evt.wait(), min(dt, 1000))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._ackevts.pop(pid, None)
+        if sample and evt.is_set():
+            self._rtt(ticks_diff(ticks_ms(), t))
+        return True  # PID received. All done.
+
+    # Update RTT estimate and RTO from a sample r (ms) as per RFC6298.
+    def _rtt(self, r):
+        if self._srtt is None:
+            self._srtt = r
+            self._rttvar = r >> 1
         else:
-            return True  # PID received. All done.
-        return False
-
-    # qos == 1: coro blocks until wait_msg gets correct PID.
-    # If WiFi fails completely subclass re-publishes with new PID.
-    async def publish(self, topic, msg, retain, qos, properties=None):
-        pid = next(self.newpid)
-        if qos:
-            self.rcv_pids.add(pid)
-        async with self.lock:
-            await self._publish(topic, msg, retain, qos, 0, pid, properties)
+            self._rttvar += (abs(self._srtt - r) - self._rttvar) >> 2
+            self._srtt += (r - self._srtt) >> 3
+        self._rto = min(max(self._srtt + 4 * self._rttvar, self._rto_min), self._rto_max)
+        m = self.metrics
+        m["srtt_ms"] = self._srtt
+        m["rttvar_ms"] = self._rttvar
+        m["rto_ms"] = self._rto
+
+    # Return the in-flight entry for a pid or None.
+    def _in_flight(self, pid):
+        for entry in self._inflight:
+            if entry[0] == pid:
+                return entry
+        return None
+
+    # qos == 1: coro blocks until wait_msg gets correct PID. If the link fails
+    # the publication stays in the in-flight table and OSError is raised: the
+    # subclass retries. If pid is in the table it was resent on reconnection
+    # with the same PID, and the publication resumes by awaiting its PUBACK.
+    # Otherwise the subclass republishes with a new PID.
+    async def publish(self, topic, msg, retain, qos, properties=None, pid=None):
+        if self.mqttv5:
+            properties = encode_properties(properties)
+        if pid is None:
+            pid = next(self.newpid)
         if qos == 0:
-            return
-
-        count = 0
-        while 1:  # Await PUBACK, republish on timeout
-            if await self._await_pid(pid):
-                return
-            # No match
-            if count >= self._max_repubs or not self.isconnected():
-                raise OSError(-1)  # Subclass to re-publish with new PID
-            async with self.lock:
-                # Add pid
+            return await self._publish(topic, msg, retain, qos, 0, pid, properties)
+        resumed = (entry := self._in_flight(pid)) is not None
+        if not resumed:
+            self.rcv_pids.add(pid)
+            entry = (pid, topic, msg, retain, properties)
+            self._inflight.append(entry)
+        keep = False
+        try:
+            if not resumed:
+                await self._publish(topic, msg, retain, qos, 0, pid, properties)
+            count = 0
+            while 1:  # Await PUBACK, republish on timeout
+                if await self._await_pid(pid, not (count or resumed)):
+                    return
+                # No match
+                if count >= self._max_repubs or not self.isconnected():
+                    keep = True  # May be resent on reconnection
+                    raise OSError(-1)  # Subclass to re-publish
                 await self._publish(topic, msg, retain, qos, dup=1, pid=pid, properties=properties)
-            count += 1
-            self.REPUB_COUNT += 1
+                count += 1
+                self.REPUB_COUNT += 1
+                self.metrics["repubs"] = self.metrics.get("repubs", 0) + 1
+        except OSError:
+            keep = True
+            raise
+        finally:
+            if not keep and entry in self._inflight:
+                self._inflight.remove(entry)
 
+    # properties are encoded (MQTTv5) or None.
     async def _publish(self, topic, msg, retain, qos, dup, pid, properties=None):
-        pkt = bytearray(b"\x30\0\0\0")
-        pkt[0] |= qos << 1 | retain | dup << 3
-        sz = 2 + len(topic) + len(msg)
-        if qos > 0:
-            sz += 2
-
-        if self.mqttv5:
-            properties = encode_properties(properties)
-            sz += len(properties)
-
-        await self._as_write(pkt, vbi(pkt, 1, sz))  # Encode size as VBI
-        await self._send_str(topic)
-        if qos > 0:
-            struct.pack_into("!H", pkt, 0, pid)
-            await self._as_write(pkt, 2)
-        if self.mqttv5:
-            await self._as_write(properties)
-        await self._as_write(msg)
+        hdr = 0x30 | qos << 1 | retain | dup << 3
+        await self._send(hdr, pid if qos else 0, topic, msg, properties)
 
     async def subscribe(self, topic, qos, properties=None):
         await self._usub(topic, qos, properties)
@@ -523,38 +803,34 @@ class MQTT_base:
     # Subscribe/unsubscribe
     # Can raise OSError if WiFi fails. Subclass traps.
     async def _usub(self, topic, qos, properties):
-        sub = qos is not None
-        pkt = bytearray(7)
-        pkt[0] = 0x82 if sub else 0xA2
         pid = next(self.newpid)
         self.rcv_pids.add(pid)
-        # 2 bytes of PID + 2 bytes of topic length + len(topic)
-        sz = 2 + 2 + len(topic) + (1 if sub else 0)
         if self.mqttv5:
-            # Return length as VBI followed by properties or b'\0'
+            # Length as VBI followed by properties or b'\0'
             properties = encode_properties(properties)
-            sz += len(properties)
-        offs = vbi(pkt, 1, sz)  # Store size as variable byte integer
-        struct.pack_into("!H", pkt, offs, pid)
-
-        async with self.lock:
-            await self._as_write(pkt, offs + 2)
-            if self.mqttv5:
-                await self._as_write(properties)
-            await self._send_str(topic)
-            if sub:
-                # Only QoS is supported other features such as:
-                # (NL) No Local, (RAP) Retain As Published and Retain Handling.
-                # Are not supported.
-                await self._as_write(qos.to_bytes(1, "little"))
-
+        await self._send(0xA2 if qos is None else 0x82, pid, topic, qos, properties)
         if not await self._await_pid(pid):
             raise OSError(-1)
 
+    # Decompress an incoming message into ._zbuf. Return a memoryview of the
+    # result or None on failure.
+    def _decompress(self, msg):
+        from .compress import decompress
+
+        if self._zbuf is None:
+            self._zbuf = bytearray(ZBUFSIZE)
+        try:
+            return memoryview(self._zbuf)[: decompress(msg, self._zbuf)]
+        except ValueError:
+            self.metrics["z_fail"] = self.metrics.get("z_fail", 0) + 1
+            return None
+
     # Remove a pending pid after a successful receive.
     def kill_pid(self, pid, msg):
         if pid in self.rcv_pids:
             self.rcv_pids.discard(pid)
+            if (evt := self._ackevts.get(pid)) is not None:
+                evt.set()  # Wake the task in ._await_pid()
         else:
             raise OSError(-1, f"Invalid pid in {msg} packet")
 
@@ -563,131 +839,90 @@ class MQTT_base:
     # set by .setup() method. Other (internal) MQTT
     # messages processed internally.
     # Immediate return if no data available. Called from ._handle_msg().
-    async def wait_msg(self):
-        mqttv5 = self.mqttv5  # Cache local
-        try:
-            res = self._sock.read(1)  # Throws OSError on WiFi fail
-        except OSError as e:
-            if e.args[0] in BUSY_ERRORS:  # Needed by RP2
-                await asyncio.sleep_ms(0)
-                return
-            raise
-
-        if res is None:
-            return
-        assert res != b"", "Empty response"
+    # In low power mode the first byte has already been read: it is passed.
+    # Returns True if a packet was processed.
+    async def wait_msg(self, op=None):
+        p = self._parser
+        if op is None:
+            try:
+                n = self._sock.readinto(p.want(), 1)  # Throws OSError on WiFi fail
+            except OSError as e:
+                if e.args[0] in BUSY_ERRORS:  # Needed by RP2
+                    await asyncio.sleep_ms(0)
+                    return
+                raise
 
-        if res == b"\xd0":  # PINGRESP
-            await self._as_read(1)  # Update .last_rx time
-            return
-        op = res[0]
-
-        if op == 0x40:  # PUBACK
-            sz, _ = await self._recv_len()
-            if not mqttv5:
-                assert sz == 2, "Invalid PUBACK packet"
-            rcv_pid = await self._as_read(2)
-            pid = rcv_pid[0] << 8 | rcv_pid[1]
-            # For some reason even on MQTTv5 reason code is optional
-            if sz != 2:
-                reason_code = await self._as_read(1)
-                reason_code = reason_code[0]
-                if reason_code >= 0x80:
-                    raise OSError(-1, "PUBACK reason code 0x%x" % reason_code)
-            if sz > 3:
-                puback_props_sz, _ = await self._recv_len()
-                if puback_props_sz > 0:
-                    puback_props = await self._as_read(puback_props_sz)
-                    decoded_props = decode_properties(puback_props, puback_props_sz)
-                    self.dprint("PUBACK properties %s", decoded_props)
-            # No exception thrown: PUBACK successfuly received. Remove pending PID
-            self.kill_pid(pid, "PUBACK")
-
-        if op == 0x90 or op == 0xB0:  # [UN]SUBACK
-            un = "UN" if op == 0xB0 else ""
-            suback = op == 0x90
-            sz, _ = await self._recv_len()
-            rcv_pid = await self._as_read(2)
-            pid = rcv_pid[0] << 8 | rcv_pid[1]
-            sz -= 2
-            # Handle properties
-            if mqttv5:
-                suback_props_sz, sz_len = await self._recv_len()
-                sz -= sz_len
-                sz -= suback_props_sz
-                if suback_props_sz > 0:
-                    suback_props = await self._as_read(suback_props_sz)
-                    decoded_props = decode_properties(suback_props, suback_props_sz)
-                    self.dprint("[UN] SUBACK properties %s", decoded_props)
-
-            assert sz <= 1, "Got too many bytes"
-            if suback or mqttv5:
-                reason_code = await self._as_read(sz)
-                reason_code = reason_code[0]
-                if reason_code >= 0x80:
-                    raise OSError(-1, f"{un}SUBACK reason code 0x{reason_code:x}")
-            self.kill_pid(pid, f"{un}SUBACK")
-
-        if op == 0xE0:  # DISCONNECT
-            if mqttv5:
-                sz, _ = await self._recv_len()
-                reason_code = await self._as_read(1)
-                reason_code = reason_code[0]
-
-                sz -= 1
-                if sz > 0:
-                    dis_props_sz, dis_len = await self._recv_len()
-                    sz -= dis_len
-                    disconnect_props = await self._as_read(dis_props_sz)
-                    decoded_props = decode_properties(disconnect_props, dis_props_sz)
-                    self.dprint("DISCONNECT properties %s", decoded_props)
-
-                if reason_code >= 0x80:
-                    raise OSError(-1, "DISCONNECT reason code 0x%x" % reason_code)
-
-        if op & 0xF0 != 0x30:
-            return
+            if n is None:
+                return
+            if not n:
+                raise OSError(-1, "Connection closed by host")
+        else:
+            p.want()[0] = op
+        p.got(1)
+        ev = await self._recv()  # Read the remainder of the packet
+        typ = ev[0]
+        if typ == 0x40 or typ == 0x90 or typ == 0xB0:  # PUBACK, [UN]SUBACK
+            _, pid, reason_code, props = ev
+            name = "PUBACK" if typ == 0x40 else "UNSUBACK" if typ == 0xB0 else "SUBACK"
+            if props is not None:
+                self.dprint("%s properties %s", name, props)
+            if reason_code >= 0x80:
+                raise OSError(-1, f"{name} reason code 0x{reason_code:x}")
+            # No exception thrown: ACK successfuly received. Remove pending PID
+            self.kill_pid(pid, name)
+
+        if typ == 0xE0:  # DISCONNECT
+            _, reason_code, props = ev
+            if props is not None:
+                self.dprint("DISCONNECT properties %s", props)
+            if reason_code >= 0x80:
+                raise OSError(-1, "DISCONNECT reason code 0x%x" % reason_code)
+
+        if typ != 0x30:  # PINGRESP needs no action: ._as_readinto() updated .last_rx
+            return True
 
-        sz, _ = await self._recv_len()
-        topic_len = await self._as_read(2)
-        topic_len = (topic_len[0] << 8) | topic_len[1]
-        topic = await self._as_read(topic_len)
-        topic = bytes(topic)  # Copy before re-using the read buffer
-        sz -= topic_len + 2
-        # MQTT V3.1.1 section 2.3.1 non-normative comment. Get server PID.
-        if op & 6:  # This is distinct from client PIDs.
-            pid = await self._as_read(2)
-            pid = pid[0] << 8 | pid[1]
-            sz -= 2
-
-        decoded_props = None
-        if mqttv5:
-            pub_props_sz, pub_props_sz_len = await self._recv_len()
-            sz -= pub_props_sz_len
-            sz -= pub_props_sz
-            if pub_props_sz > 0:
-                pub_props = await self._as_read(pub_props_sz)
-                decoded_props = decode_properties(pub_props, pub_props_sz)
-
-        msg = await self._as_read(sz)
-        # In event mode we must copy the message otherwise .queue contents will be wrong:
-        # every entry would contain the same message.
-        # In callback mode not copying the message is OK so long as the callback is purely
-        # synchronous. Overruns can't occur because of the lock.
-        if self._events or MSG_BYTES:
-            msg = bytes(msg)
-        retained = op & 0x01
-        args = [topic, msg, bool(retained)]
-        if mqttv5:
-            args.append(decoded_props)
-        self._cb(*args)
-
-        if op & 6 == 2:  # qos 1
-            pkt = bytearray(b"\x40\x02\0\0")  # Send PUBACK
-            struct.pack_into("!H", pkt, 2, pid)
-            await self._as_write(pkt)
+        _, op, pid, topic, msg, decoded_props = ev
+        # A redelivery (DUP flag) of a qos==1 message which was already received
+        # is discarded, but must be acknowledged.
+        dup = op & 0x0E == 0x0A and self._dups is not None and pid in self._dups
+        if dup:
+            msg = None
+        elif decoded_props is not None and decoded_props.get(0x03) == "application/zlib":
+            t = ticks_us()
+            msg = self._decompress(msg)  # None if corrupt or oversize: discard
+            if self.lag is not None:
+                self.lag.record("zlib", ticks_diff(ticks_us(), t))
+            if msg is not None:  # Payload is no longer zlib
+                del decoded_props[0x03]
+        if msg is not None:
+            # In event mode we must copy the message otherwise .queue contents will be wrong:
+            # every entry would contain the same message.
+            # In callback mode not copying the message is OK so long as the callback is purely
+            # synchronous. Overruns can't occur because of the lock.
+            if not self._static:
+                topic = bytes(topic)
+                if self._events or MSG_BYTES:
+                    msg = bytes(msg)
+            retained = bool(op & 0x01)
+            if (lag := self.lag) is not None:
+                t = ticks_us()
+            if self.mqttv5:
+                self._cb(topic, msg, retained, decoded_props)
+            else:
+                self._cb(topic, msg, retained)
+            if lag is not None:  # Time the application's callback
+                lag.record("subs_cb", ticks_diff(ticks_us(), t))
+
+        if op & 6 == 2:  # qos 1: queue PUBACK, don't wait for it to be sent
+            if dup:
+                self.metrics["dups"] = self.metrics.get("dups", 0) + 1
+            elif (d := self._dups) is not None:  # Record PID once delivered
+                d[self._dupix] = pid
+                self._dupix = (self._dupix + 1) % len(d)
+            await self._send(0x40, pid, wait=False)
         elif op & 6 == 4:  # qos 2 not supported
             raise OSError(-1, "QoS 2 not supported")
+        return True
 
 
 # MQTTClient class. Handles issues relating to connectivity.
@@ -697,88 +932,24 @@ class MQTTClient(MQTT_base):
     def __init__(self, config):
         super().__init__(config)
         self._isconnected = False  # Current connection state
-        keepalive = 1000 * self._keepalive  # ms
-        self._ping_interval = keepalive // 4 if keepalive else 20000
-        p_i = config["ping_interval"] * 1000  # Can specify shorter e.g. for subscribe-only
-        if p_i and p_i < self._ping_interval:
-            self._ping_interval = p_i
         self._in_connect = False
         self._has_connected = False  # Define 'Clean Session' value to use.
+        self._link = False  # Cached link state. See ._linkup()
+        self._link_t = 0  # Time of last query
         self._tasks = []
         if ESP8266:
             import esp
 
             esp.sleep_type(0)  # Improve connection integrity at cost of power consumption.
 
-    async def wifi_connect(self, quick=False):
-        s = self._sta_if
-        if ESP8266:
-            if s.isconnected():  # 1st attempt, already connected.
-                return
-            s.active(True)
-            s.connect()  # ESP8266 remembers connection.
-            for _ in range(60):
-                # Break out on fail or success. Check once per sec.
-                if s.status() != network.STAT_CONNECTING:
-                    break
-                await asyncio.sleep(1)
-            # might hang forever awaiting dhcp lease renewal or something else
-            if s.status() == network.STAT_CONNECTING:
-                s.disconnect()
-                await asyncio.sleep(1)
-            if not s.isconnected() and self._ssid is not None and self._wifi_pw is not None:
-                s.connect(self._ssid, self._wifi_pw)
-                # Break out on fail or success. Check once per sec.
-                while s.status() == network.STAT_CONNECTING:
-                    await asyncio.sleep(1)
-        else:
-            s.active(True)
-            if RP2:  # Disable auto-sleep.
-                # https://datasheets.raspberrypi.com/picow/connecting-to-the-internet-with-pico-w.pdf
-                # para 3.6.3
-                s.config(pm=0xA11140)
-            s.connect(self._ssid, self._wifi_pw)
-            for _ in range(60):  # Break out on fail or success. Check once per sec.
-                await asyncio.sleep(1)
-                # Loop while connecting or no IP
-                if s.isconnected():
-                    break
-                if ESP32:
-                    # Status values >= STAT_IDLE can occur during connect:
-                    # STAT_IDLE 1000, STAT_CONNECTING 1001, STAT_GOT_IP 1010
-                    # Error statuses are in range 200..204
-                    if s.status() < network.STAT_IDLE:
-                        # pause as workaround to avoid persistent reconnect failures
-                        # see https://github.com/peterhinch/micropython-mqtt/issues/132 for details
-                        await asyncio.sleep(1)
-                        break
-                elif PYBOARD:  # No symbolic constants in network
-                    if not 1 <= s.status() <= 2:
-                        break
-                elif RP2:  # 1 is STAT_CONNECTING. 2 reported by user (No IP?)
-                    if not 1 <= s.status() <= 2:
-                        break
-            else:  # Timeout: still in connecting state
-                s.disconnect()
-                await asyncio.sleep(1)
-
-        if not s.isconnected():  # Timed out
-            raise OSError("Wi-Fi connect timed out")
-        if not quick:  # Skip on first connection only if power saving
-            # Ensure connection stays up for a few secs.
-            self.dprint("Checking WiFi integrity.")
-            for _ in range(5):
-                if not s.isconnected():
-                    raise OSError("Connection Unstable")  # in 1st 5 secs
-                await asyncio.sleep(1)
-            self.dprint("Got reliable connection")
+    async def wifi_connect(self, quick=False):  # Bring up the link
+        await self._transport.up(self, quick)
 
     async def connect(self, *, quick=False):  # Quick initial connect option for battery apps
         if not self._has_connected:
             await self.wifi_connect(quick)  # On 1st call, caller handles error
-            # Note this blocks if DNS lookup occurs. Do it once to prevent
-            # blocking during later internet outage:
-            self._addr = socket.getaddrinfo(self.server, self.port)[0][-1]
+        # Lookup is asynchronous. During an outage the last known address is used.
+        self._addr = await self._resolve()
         self._in_connect = True  # Disable low level ._isconnected check
         try:
             is_clean = self._clean
@@ -798,13 +969,26 @@ class MQTTClient(MQTT_base):
                     await asyncio.sleep(2)  # Wait for broker to disconnect
                     self.dprint("About to reconnect with unclean session.")
             await self._connect(is_clean)
+            self._txn = 0
+            self.rcv_pids.clear()
+            if self._session:  # Resend unacknowledged publications as one batch.
+                for pid, topic, msg, retain, props in self._inflight:
+                    self.rcv_pids.add(pid)
+                    await self._encode(0x3A | retain, pid, topic, msg, props)  # qos 1, DUP
+                await self._flush()
+                self.metrics["resent"] = self.metrics.get("resent", 0) + len(self._inflight)
+            else:  # Publications will be sent with new PIDs.
+                self._inflight.clear()
+                if (d := self._dups) is not None:  # Broker PIDs are also new.
+                    for n in range(len(d)):
+                        d[n] = 0
         except Exception:
             self._close()
             self._in_connect = False  # Caller may run .isconnected()
             raise
-        self.rcv_pids.clear()
         # If we get here without error broker/LAN must be up.
         self._isconnected = True
+        self.metrics["mem_peak"] = gc.mem_alloc()  # Peak since connection
         self._in_connect = False  # Low level code can now check connectivity.
         if not self._events:
             asyncio.create_task(self._wifi_handler(True))  # User handler.
@@ -812,23 +996,74 @@ class MQTTClient(MQTT_base):
             self._has_connected = True  # Use normal clean flag on reconnect.
             asyncio.create_task(self._keep_connected())
             # Runs forever unless user issues .disconnect()
-
-        asyncio.create_task(self._handle_msg())  # Task quits on connection fail.
-        self._tasks.append(asyncio.create_task(self._keep_alive()))
-        if self.DEBUG:
-            self._tasks.append(asyncio.create_task(self._memory()))
+            if self.lag is not None:
+                asyncio.create_task(self.lag.run(self))
+            if self._journal is not None:  # Replay publications lost by a reset
+                for rec in self._journal.pending():
+                    asyncio.create_task(self._replay(*rec))
+
+        for q in self._txq:  # Accept outgoing packets
+            q.open = True
+        self._tasks.append(asyncio.create_task(self._writer()))
+        if self._low_power:  # One task performs all periodic duties.
+            self._tasks.append(asyncio.create_task(self._lp_wheel()))
+        else:
+            asyncio.create_task(self._handle_msg())  # Task quits on connection fail.
+            self._tasks.append(asyncio.create_task(self._keep_alive()))
+            if self.DEBUG:
+                from .diag import memory
+
+                self._tasks.append(asyncio.create_task(memory(self)))
+        if self._resolver:
+            self._tasks.append(asyncio.create_task(self._dns_refresh()))
         if self._events:
             self.up.set()  # Connectivity is up
         else:
             asyncio.create_task(self._connect_handler(self))  # User handler.
 
+    # Return the broker's socket address. Hostnames are resolved without blocking
+    # and cached for their TTL. If the resolver has never succeeded the blocking
+    # socket.getaddrinfo() is the last resort.
+    async def _resolve(self):
+        if self._resolver is None:
+            from .dns import Resolver
+
+            try:
+                if not (dns := self._dns or self._transport.dns()):
+                    raise OSError  # No DNS server known: the OS may resolve
+                self._resolver = Resolver(*dns) if isinstance(dns, tuple) else Resolver(dns)
+            except (OSError, AttributeError, IndexError):  # No DNS server known
+                self._resolver = False
+        if self._resolver:
+            try:
+                return socket.getaddrinfo(await self._resolver.resolve(self.server), self.port)[0][-1]
+            except OSError:
+                if self._addr is not None:
+                    return self._addr
+        elif self._addr is not None:
+            return self._addr  # Numeric address or no resolver
+        return socket.getaddrinfo(self.server, self.port)[0][-1]  # May block
+
+    # Launched by .connect() if a resolver is in use. Refreshes the broker
+    # address when its TTL expires. A changed address is used on reconnection.
+    async def _dns_refresh(self):
+        from .dns import TTL_MIN
+
+        while True:
+            await asyncio.sleep(max(self._resolver.ttl(self.server), TTL_MIN))
+            if (addr := await self._resolve()) != self._addr:
+                self.dprint("Broker address changed.")
+                self._addr = addr
+
     # Launched by .connect(). Runs until connectivity fails. Checks for and
     # handles incoming messages.
     async def _handle_msg(self):
         try:
             while self.isconnected():
                 async with self.lock:
-                    await self.wait_msg()  # Immediate return if no message
+                    for _ in range(8):  # Process a burst of packets
+                        if not await self.wait_msg():  # Immediate return if no message
+                            break
                 # https://github.com/peterhinch/micropython-mqtt/issues/166
                 # A delay > 0 is necessary for webrepl compatibility.
                 await asyncio.sleep_ms(5)  # Let other tasks get lock
@@ -837,19 +1072,80 @@ class MQTTClient(MQTT_base):
             pass
         self._reconnect()  # Broker or WiFi fail.
 
+    # Launched by .connect(). Runs until connectivity fails. All outgoing
+    # packets other than CONNECT and DISCONNECT are written by this task, so
+    # a slow read does not delay publications.
+    async def _writer(self):
+        ready = self._txready
+        try:
+            while True:
+                await ready.wait()
+                ready.clear()
+                await self._write_queue()
+        except OSError:
+            pass
+        self._reconnect()  # Broker or WiFi fail.
+
     # Keep broker alive MQTT spec 3.1.2.10 Keep Alive.
+    # Traffic in both directions proves the link, so a ping is only sent when
+    # nothing has been sent, or nothing received, for a ping interval.
+    # Return ms until a ping is due. tping: time of last ping.
+    def _ping_due(self, tping):
+        now = ticks_ms()
+        # An unanswered ping is not repeated for a ping interval.
+        rx = ticks_diff(now, self.last_rx if ticks_diff(self.last_rx, tping) > 0 else tping)
+        return self._ping_interval - max(rx, ticks_diff(now, self.last_tx))
+
+    def _broker_fail(self):  # Nothing received in keepalive period.
+        if ticks_diff(ticks_ms(), self.last_rx) >= 4 * self._ping_interval:
+            self.dprint("Reconnect: broker fail.")
+            return True
+        return False
+
     # Runs until ping failure or no response in keepalive period.
     async def _keep_alive(self):
-        while self.isconnected():
-            pings_due = ticks_diff(ticks_ms(), self.last_rx) // self._ping_interval
-            if pings_due >= 4:
-                self.dprint("Reconnect: broker fail.")
-                break
-            await asyncio.sleep_ms(self._ping_interval)
+        tping = ticks_ms()  # Time of last ping
+        while self.isconnected() and not self._broker_fail():
+            if (due := self._ping_due(tping)) > 0:
+                await asyncio.sleep_ms(due)
+                continue
             try:
                 await self._ping()
             except OSError:
                 break
+            tping = ticks_ms()
+        self._reconnect()  # Broker or WiFi fail.
+
+    # Low power mode: launched by .connect() in place of ._handle_msg(),
+    # ._keep_alive() and the DEBUG memory monitor. Computes the time to the
+    # next periodic duty and awaits incoming data in the interim, minimising
+    # wakeups.
+    # Runs until connectivity fails.
+    async def _lp_wheel(self):
+        stream = self._transport.reader(self._sock)
+        tping = tcheck = ticks_ms()
+        try:
+            while not self._broker_fail():
+                if (wait := LP_CHECK_MS - ticks_diff(ticks_ms(), tcheck)) <= 0:
+                    if not self.isconnected():  # Checks WiFi
+                        break
+                    self._heap()
+                    tcheck = ticks_ms()
+                    continue
+                if (due := self._ping_due(tping)) <= 0:
+                    await self._ping()
+                    tping = ticks_ms()
+                    continue
+                try:
+                    res = await asyncio.wait_for_ms(stream.read(1), min(due, wait))
+                except asyncio.TimeoutError:
+                    continue
+                if res == b"":
+                    raise OSError(-1, "Connection closed by host")
+                async with self.lock:
+                    await self.wait_msg(res[0])
+        except OSError:
+            pass
         self._reconnect()  # Broker or WiFi fail.
 
     async def _kill_tasks(self, kill_skt):  # Cancel running tasks
@@ -857,27 +1153,58 @@ class MQTTClient(MQTT_base):
             task.cancel()
         self._tasks.clear()
         await asyncio.sleep_ms(0)  # Ensure cancellation complete
+        for q in self._txq:  # Senders of unwritten packets get OSError
+            q.discard()
         if kill_skt:  # Close socket
             self._close()
 
-    # DEBUG: show RAM messages.
-    async def _memory(self):
-        while True:
-            await asyncio.sleep(20)
-            gc.collect()
-            self.dprint("RAM free %d alloc %d", gc.mem_free(), gc.mem_alloc())
-
     def isconnected(self):
         if self._in_connect:  # Disable low-level check during .connect()
             return True
 
-        if self._isconnected and not self._sta_if.isconnected():  # It's going down.
+        if self._isconnected and not self._linkup():  # It's going down.
             self._reconnect()
         return self._isconnected
 
+    # Return the link state. A good state is cached for LINK_MS: ._keep_connected
+    # refreshes it once per second, the I/O loops more often. A bad state is
+    # always rechecked.
+    def _linkup(self):
+        t = ticks_ms()
+        if not self._link or ticks_diff(t, self._link_t) >= LINK_MS:
+            self._link = self._transport.isconnected()
+            self._link_t = t
+            self.metrics["link_queries"] = self.metrics.get("link_queries", 0) + 1
+        return self._link
+
+    # Update heap metrics and collect garbage if free RAM is below GC_FREE% of
+    # the heap. mem_peak is the highest allocation sampled since connection:
+    # samples are taken here before collection.
+    def _heap(self):
+        m = self.metrics
+        free = gc.mem_free()
+        alloc = gc.mem_alloc()
+        if alloc > m.get("mem_peak", 0):
+            m["mem_peak"] = alloc
+        if free * 100 < (free + alloc) * GC_FREE:
+            t = ticks_us()
+            gc.collect()
+            t = ticks_diff(ticks_us(), t)
+            m["gc_runs"] = m.get("gc_runs", 0) + 1
+            m["gc_us"] = m.get("gc_us", 0) + t
+            if t > m.get("gc_max_us", 0):
+                m["gc_max_us"] = t
+            free = gc.mem_free()
+            alloc = gc.mem_alloc()
+        m["mem_free"] = free
+        m["mem_alloc"] = alloc
+        m["ibuf_hw"] = self._parser.size()
+
     def _reconnect(self):  # Schedule a reconnection if not underway.
         if self._isconnected:
             self._isconnected = False
+            if self._low_power:
+                self._linkdown.set()
             asyncio.create_task(self._kill_tasks(True))  # Shut down tasks and socket
             if self._events:  # Signal an outage
                 self.down.set()
@@ -893,12 +1220,15 @@ class MQTTClient(MQTT_base):
     # broker connection. Must handle conditions at edge of WiFi range.
     async def _keep_connected(self):
         while self._has_connected:
-            if self.isconnected():  # Pause for 1 second
+            if self._low_power and self._isconnected:  # Await ._reconnect()
+                await self._linkdown.wait()
+                self._linkdown.clear()
+            elif self.isconnected():  # Pause for 1 second
                 await asyncio.sleep(1)
-                gc.collect()
+                self._heap()
             else:  # Link is down, socket is closed, tasks are killed
                 try:
-                    self._sta_if.disconnect()
+                    self._transport.down()
                 except OSError:
                     self.dprint("Wi-Fi not started, unable to disconnect interface")
                 await asyncio.sleep(1)
@@ -940,12 +1270,48 @@ class MQTTClient(MQTT_base):
                 pass
             self._reconnect()  # Broker or WiFi fail.
 
-    async def publish(self, topic, msg, retain=False, qos=0, properties=None):
+    async def publish(self, topic, msg, retain=False, qos=0, properties=None, compress=None):
         qos_check(qos)
+        if compress is not None and not self.mqttv5:
+            raise ValueError("compression requires MQTTv5.")
+        if self._zpolicy is not None or compress:
+            if self._zpolicy is None:  # Per-publication compression only
+                from .compress import Policy
+
+                self._zpolicy = Policy({})
+            msg, properties = self._zpolicy.outgoing(topic, msg, properties, compress, self.metrics)
+        jid = None
+        if qos and self._journal is not None:  # Returns when written to flash
+            props = encode_properties(properties) if self.mqttv5 else b""
+            jid = await self._journal.add(topic, msg, retain, props)
+        if self._shaper is not None:  # Delay if a rate limit would be exceeded
+            if isinstance(msg, str):  # Limit is in bytes
+                msg = msg.encode()
+            t = await self._shaper.wait(topic, len(msg))
+            self.metrics["rate_wait_ms"] = self.metrics.get("rate_wait_ms", 0) + t
+        await self._pub(topic, msg, retain, qos, properties)
+        if jid is not None:
+            self._journal.ack(jid)
+
+    # Publish a journalled message which was unacknowledged at power up.
+    async def _replay(self, jid, topic, msg, retain, props):
+        properties = None
+        if self.mqttv5 and len(props) > 1:
+            n, offs = decode_vbi(props, 0)
+            properties = decode_properties(props[offs:], n)
+        await self._pub(topic, msg, retain, 1, properties)
+        self._journal.ack(jid)
+        self.metrics["replayed"] = self.metrics.get("replayed", 0) + 1
+
+    # Publish, retrying after connectivity failures.
+    async def _pub(self, topic, msg, retain, qos, properties):
+        pid = None
         while 1:
             await self._connection()
+            if self._in_flight(pid) is None:  # Not resent on reconnection: use a new PID.
+                pid = next(self.newpid)
             try:
-                return await super().publish(topic, msg, retain, qos, properties)
+                return await super().publish(topic, msg, retain, qos, properties, pid)
             except OSError:
                 pass
             self._reconnect()  # Broker or WiFi fail.
@@ -0,0 +1,237 @@
+# capture.py Record and replay of broker traffic for mqtt_as
+
+# (C) Copyright Peter Hinch 2026.
+# Released under the MIT licence.
+
+# record(client, fname) logs every byte the client sends and receives, with
+# timestamps, to a file. replay(client, fname) connects the client to the
+# file instead of a broker: received data is fed to the client at the recorded
+# times or as fast as it can be read. Outgoing data is discarded. This allows
+# a field trace to be used as a repeatable benchmark. Acknowledgements (PUBACK,
+# SUBACK, UNSUBACK) answer the recording client's requests, not those of the
+# replaying client, so they are not replayed.
+# File format: b"MQTC\x01" followed by records. Each record is a type byte,
+# then the time since the previous record (ms) as a Variable Byte Integer. Data
+# records are followed by the data length (VBI) and the data.
+# Capture records data above TLS. Neither capture nor replay supports low
+# power mode, which polls the socket directly.
+
+from time import ticks_ms, ticks_diff
+from . import vbi
+from .transport import Socket
+
+MAGIC = b"MQTC\x01"
+CONNECT = 0x43  # "C" New connection
+OUT = 0x3E  # ">" Data sent
+IN = 0x3C  # "<" Data received
+
+
+def _rvbi(buf, offs):  # Decode a VBI. Return value and offset of next byte.
+    value = sh = 0
+    while True:
+        b = buf[offs]
+        offs += 1
+        value |= (b & 0x7F) << sh
+        sh += 7
+        if not b & 0x80:
+            return value, offs
+
+
+# Read a capture. Return a list of connections, each a list of
+# (type, ms since connection, data) tuples.
+def load(fname):
+    with open(fname, "rb") as f:
+        buf = f.read()
+    if buf[: len(MAGIC)] != MAGIC:
+        raise ValueError("Not a capture file")
+    offs = len(MAGIC)
+    conns = []
+    t = 0
+    while offs < len(buf):
+        typ = buf[offs]
+        dt, offs = _rvbi(buf, offs + 1)
+        t += dt
+        if typ == CONNECT:
+            t0 = t
+            conns.append([])
+            continue
+        n, offs = _rvbi(buf, offs)
+        conns[-1].append((typ, t - t0, buf[offs : offs + n]))
+        offs += n
+    return conns
+
+
+class Recorder:
+    def __init__(self, fname):
+        self._f = open(fname, "wb")
+        self._f.write(MAGIC)
+        self._hdr = bytearray(11)
+        self._t = ticks_ms()
+
+    def log(self, typ, data=None):
+        t = ticks_ms()
+        h = self._hdr
+        h[0] = typ
+        n = vbi(h, 1, ticks_diff(t, self._t))
+        self._t = t
+        if data is not None:
+            n = vbi(h, n, len(data))
+        self._f.write(memoryview(h)[:n])
+        if data is not None:
+            self._f.write(data)
+
+    def close(self):
+        self._f.close()
+
+    # Return a stream which logs traffic through sock. written holds any data
+    # already sent by a TLS handshake.
+    def tap(self, sock, written):
+        self.log(CONNECT)
+        if written:
+            self.log(OUT, written)
+        return _Tap(sock, self)
+
+
+class _Tap:  # Stream wrapper which logs data.
+    def __init__(self, sock, rec):
+        self._sock = sock
+        self._rec = rec
+
+    def __getattr__(self, name):  # setblocking, close etc.
+        return getattr(self._sock, name)
+
+    def readinto(self, buf, n=None):
+        r = self._sock.readinto(buf, n or len(buf))
+        if r:
+            self._rec.log(IN, memoryview(buf)[:r])
+        return r
+
+    def read(self, n):
+        r = self._sock.read(n)
+        if r:
+            self._rec.log(IN, r)
+        return r
+
+    def write(self, buf, off=0, n=None):
+        if isinstance(buf, str):
+            buf = buf.encode()
+        mv = memoryview(buf)[off : len(buf) if n is None else off + n]
+        r = self._sock.write(mv)
+        if r:
+            self._rec.log(OUT, mv[:r])
+        return r
+
+
+# Log the client's traffic to fname. Return the Recorder: its .close() method
+# should be called when done.
+def record(client, fname):
+    rec = Recorder(fname)
+    client._tap = rec.tap
+    return rec
+
+
+# Split the data received on a connection into MQTT packets, discarding
+# acknowledgements. Return a list of (ms since connection, packet) tuples.
+# A packet's time is that at which its first byte was received.
+def _packets(recs):
+    data = b"".join(d for typ, _, d in recs if typ == IN)
+    starts = []  # (offset, time) of each record
+    offs = 0
+    for typ, t, d in recs:
+        if typ == IN:
+            starts.append((offs, t))
+            offs += len(d)
+    pkts = []
+    offs = i = 0
+    while offs < len(data):
+        while i + 1 < len(starts) and starts[i + 1][0] <= offs:
+            i += 1
+        try:
+            n, p = _rvbi(data, offs + 1)
+        except IndexError:  # Capture ended mid packet
+            break
+        if p + n > len(data):
+            break
+        if data[offs] & 0xF0 not in (0x40, 0x90, 0xB0):
+            pkts.append((starts[i][1], data[offs : p + n]))
+        offs = p + n
+    return pkts
+
+
+class Player(Socket):  # A transport whose connections replay a capture.
+    def __init__(self, fname, realtime):
+        super().__init__()
+        self._conns = load(fname)
+        self._realtime = realtime
+        self.done = False  # All connections replayed
+        self.lag = 0  # Max ms by which data was read later than recorded
+        self.nbytes = 0  # Bytes received by the client
+
+    def open(self, addr):
+        if not self._conns:
+            self.done = True
+            raise OSError(-1, "Capture ended")
+        return _Replay(self, _packets(self._conns.pop(0)))
+
+
+class _Replay:  # A stream which replays received data.
+    def __init__(self, player, recs):
+        self._player = player
+        self._recs = recs
+        self._offs = 0  # Offset into the current packet
+        self._t = ticks_ms()
+
+    def close(self):
+        pass
+
+    # Return the current packet. Return None if none is due. When the
+    # connection is exhausted return b"" (closed) unless it is the last.
+    def _next(self):
+        if not self._recs:
+            if self._player._conns:
+                return b""  # Client will reconnect
+            self._player.done = True
+            return None  # Last connection idles: client sees no data
+        t, data = self._recs[0]
+        dt = ticks_diff(ticks_ms(), self._t) - t
+        if self._player._realtime:
+            if dt < 0:
+                return None
+            self._player.lag = max(self._player.lag, dt)
+        return data
+
+    def _consume(self, data, n):
+        self._offs += n
+        if self._offs >= len(data):
+            self._recs.pop(0)
+            self._offs = 0
+        self._player.nbytes += n
+
+    def readinto(self, buf, n=None):
+        if not (data := self._next()):
+            return data if data is None else 0
+        n = min(n or len(buf), len(data) - self._offs)
+        buf[:n] = data[self._offs : self._offs + n]
+        self._consume(data, n)
+        return n
+
+    def read(self, n):
+        if not (data := self._next()):
+            return data
+        r = data[self._offs : self._offs + n]
+        self._consume(data, len(r))
+        return r
+
+    def write(self, buf, off=0, n=None):
+        return len(buf) - off if n is None else n
+
+
+# Connect the client to a capture rather than a broker. Each connection the
+# client makes replays the next connection in the capture. Data is fed at the
+# recorded times if realtime is True, otherwise as fast as it is read. Return
+# the Player: its .done attribute is set when the capture is exhausted.
+def replay(client, fname, realtime=True):
+    player = Player(fname, realtime)
+    client._transport = player
+    client._ssl = False  # The capture holds decrypted data
+    return player
@@ -0,0 +1,329 @@
+# codec.py Sans-IO MQTT packet encoder and parser for mqtt_as
+
+# (C) Copyright Peter Hinch 2026.
+# Released under the MIT licence.
+
+# Encoding and parsing of MQTT 3.1.1 and 5 packets, independent of sockets
+# and of asyncio, so that it may be tested and benchmarked on canned data.
+# Packets are encoded into caller buffers. A Parser accepts received bytes and
+# returns an event tuple for each complete packet:
+# (CONNACK, session_present, reason, props)
+# (PUBLISH, first_byte, pid, topic, msg, props)
+# (PUBACK, pid, reason, props) Also SUBACK and UNSUBACK.
+# (PINGRESP,)
+# (DISCONNECT, reason, props)
+# (type, body) Other packet types: body is a memoryview of the variable
+# header and payload. Allows the parser to serve a test broker.
+# pid is 0 for a qos==0 publication. props is a dict of decoded properties
+# (MQTT 5) or None. topic and msg are memoryviews into the parser's buffer: they
+# are valid until more data is passed to the parser.
+
+from micropython import const
+
+CONNACK = const(0x20)
+PUBLISH = const(0x30)
+PUBACK = const(0x40)
+SUBSCRIBE = const(0x80)
+SUBACK = const(0x90)
+UNSUBACK = const(0xB0)
+PINGRESP = const(0xD0)
+DISCONNECT = const(0xE0)
+
+_HDR = const(0)  # Parser states: awaiting first byte
+_LEN = const(1)  # Remaining Length
+_BODY = const(2)
+
+
+# Populate a byte array with a variable byte integer. Args: buf the bytearray,
+# offs: start offset. x the value. Returns the end offset.
+# 1-4 bytes allowed, encoding up to 268,435,455 (V3.1.1 table 2.4). No point trapping this.
+def vbi(buf, offs, x):
+    while True:
+        buf[offs] = x & 0x7F
+        offs += 1
+        if not (x := x >> 7):
+            return offs
+        buf[offs - 1] |= 0x80
+
+
+def _vbi_len(x):
+    n = 1
+    while x := x >> 7:
+        n += 1
+    return n
+
+
+# Where the port has the viper emitter native.py replaces the above. PURE holds
+# the Python versions for tests/perf/native.py.
+PURE = {"vbi": vbi, "_vbi_len": _vbi_len}
+try:
+    from .native import vbi, vbi_len as _vbi_len  # noqa: F811
+except Exception:  # No emitter, or CPython
+    pass
+
+
+def _put(buf, offs, data):  # Copy data into buf. Return the end offset.
+    end = offs + len(data)
+    buf[offs:end] = data
+    return end
+
+
+def _put_str(buf, offs, s):  # Length prefixed string
+    buf[offs] = len(s) >> 8
+    buf[offs + 1] = len(s) & 0xFF
+    return _put(buf, offs + 2, s)
+
+
+# Encoding. hdr is the first byte of the packet. pid == 0 signifies no PID.
+# props are encoded properties or None for MQTT 3.1.1. For PUBLISH msg is the
+# payload, for SUBSCRIBE it holds the qos. Strings must be bytes-like.
+
+
+def _remaining(hdr, pid, topic, msg, props):  # Remaining Length
+    sz = 2 if pid else 0
+    if topic is not None:
+        sz += 2 + len(topic)
+    if props is not None:
+        sz += len(props)
+    typ = hdr & 0xF0
+    if typ == PUBLISH:
+        sz += len(msg)
+    elif typ == SUBSCRIBE:
+        sz += 1
+    return sz
+
+
+def encoded_size(hdr, pid=0, topic=None, msg=None, props=None):
+    sz = _remaining(hdr, pid, topic, msg, props)
+    return 1 + _vbi_len(sz) + sz
+
+
+# Encode a packet into buf at offs, which must have room for it. Return the
+# end offset. If payload is False a PUBLISH payload is omitted: the caller
+# sends it separately, avoiding a copy of a long message.
+def encode(buf, offs, hdr, pid=0, topic=None, msg=None, props=None, payload=True):
+    typ = hdr & 0xF0
+    buf[offs] = hdr
+    offs = vbi(buf, offs + 1, _remaining(hdr, pid, topic, msg, props))
+    if typ == PUBLISH:
+        offs = _put_str(buf, offs, topic)
+    if pid:
+        buf[offs] = pid >> 8
+        buf[offs + 1] = pid & 0xFF
+        offs += 2
+    if props is not None:
+        offs = _put(buf, offs, props)
+    if typ == PUBLISH:
+        if payload:
+            offs = _put(buf, offs, msg)
+    elif topic is not None:  # [UN]SUBSCRIBE
+        offs = _put_str(buf, offs, topic)
+        if typ == SUBSCRIBE:
+            # Only QoS is supported other features such as:
+            # (NL) No Local, (RAP) Retain As Published and Retain Handling.
+            # Are not supported.
+            buf[offs] = msg
+            offs += 1
+    return offs
+
+
+# CONNECT is encoded once per connection. will is None or (topic, msg, retain,
+# qos). A user name is always accompanied by a password. str is accepted.
+def _b(s):
+    return s.encode() if isinstance(s, str) else s
+
+
+def _connect_len(client_id, user, pswd, will, props):
+    sz = 10 + 2 + len(_b(client_id))
+    if user:
+        sz += 2 + len(_b(user)) + 2 + len(_b(pswd))
+    if will is not None:
+        sz += 2 + len(_b(will[0])) + 2 + len(_b(will[1]))
+        if props is not None:
+            sz += 1  # Will properties are not supported: empty
+    if props is not None:
+        sz += len(props)
+    return sz
+
+
+def connect_size(client_id, user=None, pswd=None, will=None, props=None):
+    sz = _connect_len(client_id, user, pswd, will, props)
+    return 1 + _vbi_len(sz) + sz
+
+
+def encode_connect(buf, offs, clean, keepalive, client_id, user=None, pswd=None, will=None, props=None):
+    buf[offs] = 0x10
+    offs = vbi(buf, offs + 1, _connect_len(client_id, user, pswd, will, props))
+    offs = _put(buf, offs, b"\x00\x04MQTT")
+    buf[offs] = 0x04 if props is None else 0x05
+    flags = clean << 1
+    if user:
+        flags |= 0xC0
+    if will is not None:
+        flags |= 0x04 | (will[3] & 0x03) << 3 | will[2] << 5
+    buf[offs + 1] = flags
+    buf[offs + 2] = keepalive >> 8
+    buf[offs + 3] = keepalive & 0xFF
+    offs += 4
+    if props is not None:
+        offs = _put(buf, offs, props)
+    offs = _put_str(buf, offs, _b(client_id))
+    if will is not None:
+        if props is not None:
+            buf[offs] = 0
+            offs += 1
+        offs = _put_str(buf, offs, _b(will[0]))
+        offs = _put_str(buf, offs, _b(will[1]))
+    if user:
+        offs = _put_str(buf, offs, _b(user))
+        offs = _put_str(buf, offs, _b(pswd))
+    return offs
+
+
+# Parsing
+
+
+def _malformed(typ):
+    raise OSError(-1, "Malformed packet type 0x%x" % typ)
+
+
+class Parser:
+    # v5: True for MQTT 5. size: initial size of the input buffer. It grows to
+    # hold the largest packet received.
+    def __init__(self, v5=False, size=50):
+        self._buf = bytearray(max(size, 1))
+        self._mv = memoryview(self._buf)
+        self._mv1 = self._mv[:1]  # Header bytes are read singly
+        self._dprops = None
+        if v5:
+            from .mqtt_v5_properties import decode_properties
+
+            self._dprops = decode_properties
+        self.reset()
+
+    def size(self):  # Input buffer size. It only grows, so is its high-water mark.
+        return len(self._buf)
+
+    def reset(self):  # Discard any partial packet, e.g. on reconnection.
+        self._state = _HDR
+        self._op = 0
+        self._sz = 0  # Remaining Length
+        self._sh = 0  # Shift while decoding it
+        self._n = 0  # Bytes of the body received
+
+    # Return a memoryview into which the next bytes should be read. Its length
+    # is the number of bytes the current packet needs, so reading no more than
+    # this leaves subsequent packets in the stream.
+    def want(self):
+        if self._state == _BODY:
+            return self._mv[self._n : self._sz]
+        return self._mv1
+
+    # n bytes were read into the memoryview returned by .want(). Return an
+    # event if a packet is complete, otherwise None.
+    def got(self, n):
+        if not n:
+            return None
+        if self._state == _BODY:
+            self._n += n
+            return self._event() if self._n >= self._sz else None
+        b = self._buf[0]
+        if self._state == _HDR:
+            self._op = b
+            self._sz = self._sh = 0
+            self._state = _LEN
+            return None
+        self._sz |= (b & 0x7F) << self._sh
+        self._sh += 7
+        if b & 0x80:
+            if self._sh >= 28:
+                _malformed(self._op)
+            return None
+        if self._sz > len(self._buf):  # Grow: allows for slightly larger packets
+            self._buf = bytearray(self._sz + 50)
+            self._mv = memoryview(self._buf)
+            self._mv1 = self._mv[:1]
+        self._n = 0
+        self._state = _BODY
+        return None if self._sz else self._event()
+
+    # Parse a chunk of data. Return (event, n) where n is the number of bytes
+    # consumed. event is None if the chunk ended before a packet was complete.
+    def feed(self, data):
+        offs = 0
+        end = len(data)
+        while offs < end:
+            mv = self.want()
+            n = min(len(mv), end - offs)
+            mv[:n] = data[offs : offs + n]
+            offs += n
+            if (ev := self.got(n)) is not None:
+                return ev, offs
+        return None, offs
+
+    def _props(self, offs, end):  # MQTT 5 properties. Return (dict, end offset).
+        n = sh = 0
+        while True:
+            if offs >= end:
+                _malformed(self._op)
+            b = self._buf[offs]
+            offs += 1
+            n |= (b & 0x7F) << sh
+            sh += 7
+            if not b & 0x80:
+                break
+        if offs + n > end:
+            _malformed(self._op)
+        if not n:
+            return None, offs
+        try:
+            return self._dprops(self._mv[offs : offs + n], n), offs + n
+        except Exception:  # ValueError, IndexError, struct.error
+            _malformed(self._op)
+
+    def _event(self):  # Decode the body of a complete packet.
+        self._state = _HDR
+        op = self._op
+        typ = op & 0xF0
+        buf = self._buf
+        sz = self._sz
+        v5 = self._dprops is not None
+        props = None
+        if typ == PUBLISH:
+            if sz < 2 or (tend := (buf[0] << 8 | buf[1]) + 2) > sz:  # End of topic
+                _malformed(typ)
+            offs = tend
+            pid = 0
+            if op & 6:  # This is distinct from client PIDs.
+                if (offs := tend + 2) > sz:
+                    _malformed(typ)
+                pid = buf[tend] << 8 | buf[tend + 1]
+            if v5:
+                props, offs = self._props(offs, sz)
+            return (PUBLISH, op, pid, self._mv[2:tend], self._mv[offs:sz], props)
+        if typ == PINGRESP:
+            return (PINGRESP,)
+        if typ == CONNACK:
+            if sz < 2 or buf[0] & 0xFE or (not v5 and sz != 2):
+                _malformed(typ)
+            if v5:
+                props, _ = self._props(2, sz)
+            return (CONNACK, bool(buf[0]), buf[1], props)
+        if typ == PUBACK or typ == SUBACK or typ == UNSUBACK:
+            if sz < 2 or (not v5 and typ == PUBACK and sz != 2):
+                _malformed(typ)
+            offs = 2
+            if v5 and typ != PUBACK:  # Properties precede the reason code(s)
+                props, offs = self._props(offs, sz)
+            # For some reason even on MQTTv5 reason code is optional. A
+            # MQTT 3.1.1 UNSUBACK has none. One topic per [UN]SUBSCRIBE.
+            reason = buf[offs] if offs < sz else 0
+            if v5 and typ == PUBACK and sz > 3:
+                props, _ = self._props(3, sz)
+            return (typ, buf[0] << 8 | buf[1], reason, props)
+        if typ == DISCONNECT:
+            reason = buf[0] if sz else 0
+            if v5 and sz > 1:
+                props, _ = self._props(1, sz)
+            return (DISCONNECT, reason, props)
+        return (typ, self._mv[:sz])
@@ -0,0 +1,93 @@
+# compress.py Payload compression for mqtt_as
+
+# (C) Copyright Peter Hinch 2026.
+# Released under the MIT licence.
+
+# Payloads are compressed in zlib format. The MQTTv5 Content Type property
+# identifies them so that a receiving client can decompress them. Firmware
+# must include the deflate module: compression also requires it to be built
+# with MICROPY_PY_DEFLATE_COMPRESS. Under CPython zlib is used.
+
+try:
+    import deflate
+    from io import BytesIO
+except ImportError:
+    deflate = None
+    import zlib
+
+CONTENT_TYPE = "application/zlib"
+WBITS = 9  # Compression window 512 bytes: limits RAM used by the receiver.
+
+
+def compress(data):
+    if deflate is None:
+        c = zlib.compressobj(9, zlib.DEFLATED, WBITS)
+        return c.compress(data) + c.flush()
+    s = BytesIO()
+    with deflate.DeflateIO(s, deflate.ZLIB, WBITS) as d:
+        d.write(data)
+    return s.getvalue()
+
+
+# Decompress data into buf. Return the length of the result. Raises ValueError
+# if data is corrupt or too large for buf.
+def decompress(data, buf):
+    size = len(buf)
+    try:
+        if deflate is None:
+            d = zlib.decompressobj()
+            r = d.decompress(data, size)
+            if d.unconsumed_tail or not d.eof:
+                raise ValueError
+            n = len(r)
+            buf[:n] = r
+            return n
+        d = deflate.DeflateIO(BytesIO(data), deflate.ZLIB)
+        mv = memoryview(buf)
+        n = 0
+        while n < size and (r := d.readinto(mv[n:])):
+            n += r
+        if n == size and d.read(1):
+            raise ValueError
+        return n
+    except Exception:  # OSError, ValueError, zlib.error
+        raise ValueError("Cannot decompress message")
+
+
+class Policy:
+    # topics: {prefix: threshold} Payloads on a topic starting with prefix are
+    # compressed if their length is at least threshold.
+    def __init__(self, topics):
+        self._topics = []
+        for prefix, threshold in topics.items():
+            if isinstance(prefix, str):
+                self._topics.append((prefix, prefix.encode(), threshold))
+            else:
+                self._topics.append((bytes(prefix).decode(), bytes(prefix), threshold))
+
+    def threshold(self, topic):  # Return None if topic is not compressed
+        s = isinstance(topic, str)
+        t = None
+        for sp, bp, threshold in self._topics:
+            if topic.startswith(sp if s else bp):
+                t = threshold if t is None else min(t, threshold)
+        return t
+
+    # Return (msg, properties), compressing msg if appropriate. force: True
+    # to compress regardless of size, False to prevent compression.
+    def outgoing(self, topic, msg, properties, force, metrics):
+        if force is False or (force is None and (t := self.threshold(topic)) is None):
+            return msg, properties
+        if isinstance(msg, str):  # Threshold and saving are in bytes
+            msg = msg.encode()
+        if force is None and len(msg) < t:
+            return msg, properties
+        if properties and 0x03 in properties:  # Application's Content Type
+            return msg, properties
+        z = compress(msg)
+        if len(z) >= len(msg):
+            return msg, properties
+        metrics["z_saved"] = metrics.get("z_saved", 0) + len(msg) - len(z)
+        properties = dict(properties) if properties else {}
+        properties[0x03] = CONTENT_TYPE
+        return z, properties
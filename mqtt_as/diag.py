@@ -0,0 +1,61 @@
+# diag.py Diagnostic functions for mqtt_as
+
+# (C) Copyright Peter Hinch 2017-2026.
+# Released under the MIT licence.
+
+# Rarely used code, imported on first use.
+
+import asyncio
+import gc
+from . import socket  # Host mode: see host.py
+
+# DNS query for www.google.com
+_QUERY = b"$\x1a\x01\x00\x00\x01\x00\x00\x00\x00\x00\x00\x03www\x06google\x03com\x00\x00\x01\x00\x01"
+
+
+# Check internet connectivity by sending DNS lookup to Google's 8.8.8.8
+async def wan_ok(client, packet=None):
+    if not client.isconnected():  # WiFi is down
+        return False
+    length = 32  # DNS query and response packet size
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.setblocking(False)
+    s.connect(("8.8.8.8", 53))
+    await asyncio.sleep(1)
+    try:
+        await client._as_write(_QUERY if packet is None else packet, sock=s)
+        await asyncio.sleep(2)
+        await client._as_readinto(bytearray(length), s)
+        return True  # DNS response size OK
+    except OSError:  # Timeout on read: no connectivity.
+        return False
+    finally:
+        s.close()
+
+
+# DEBUG: show heap metrics, which are updated by the client.
+async def memory(client):
+    m = client.metrics
+    while True:
+        await asyncio.sleep(20)
+        client.dprint("RAM free %d alloc %d peak %d", m.get("mem_free", 0), m.get("mem_alloc", 0), m.get("mem_peak", 0))
+
+
+# Return the size of the largest block which can be allocated (bytes). This is
+# found by trial allocation, collecting garbage after each attempt, so it is
+# too costly to run often. If metrics (a client's .metrics) is passed the result
+# is stored as "mem_max_free". Under CPython returns 0.
+def max_free(metrics=None):
+    gc.collect()
+    lo, hi = 0, gc.mem_free()
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        try:
+            bytearray(mid)
+            lo = mid
+        except MemoryError:
+            hi = mid - 1
+        gc.collect()
+    if metrics is not None:
+        metrics["mem_max_free"] = lo
+    return lo
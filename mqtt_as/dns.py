@@ -0,0 +1,120 @@
+# dns.py Non-blocking DNS resolver for mqtt_as
+
+# (C) Copyright Peter Hinch 2026.
+# Released under the MIT licence.
+
+# A minimal UDP resolver for IPv4 A records. Unlike socket.getaddrinfo() it
+# does not block the scheduler. Results are cached for the TTL returned by the
+# server. If the server cannot be reached the last known address is returned.
+
+import socket
+import struct
+import asyncio
+from time import ticks_ms, ticks_diff, ticks_add
+from errno import EAGAIN
+
+TTL_MIN = 10  # Secs. Limit query rate if server returns tiny TTL values.
+
+
+# Build a query for an A record.
+def query(host, qid):
+    pkt = bytearray(struct.pack("!HHHHHH", qid, 0x0100, 1, 0, 0, 0))  # Recursion desired
+    for label in host.split("."):
+        pkt.append(len(label))
+        pkt.extend(label.encode())
+    pkt.extend(b"\0\0\x01\0\x01")  # Root label, QTYPE A, QCLASS IN
+    return pkt
+
+
+# Skip a (possibly compressed) name. Return offset of following field.
+def _skip(buf, offs):
+    while n := buf[offs]:
+        if n & 0xC0 == 0xC0:  # Pointer terminates the name
+            return offs + 2
+        offs += n + 1
+    return offs + 1
+
+
+# Parse a response. Return (address, ttl) or None if it holds no A record.
+def parse(buf, qid):
+    rid, flags, qd, an = struct.unpack_from("!HHHH", buf, 0)
+    if rid != qid or not flags & 0x8000 or flags & 0x0F:  # Not our response or RCODE != 0
+        return None
+    offs = 12
+    for _ in range(qd):
+        offs = _skip(buf, offs) + 4  # QTYPE, QCLASS
+    for _ in range(an):
+        offs = _skip(buf, offs)
+        rtype, rclass, ttl, rdlen = struct.unpack_from("!HHIH", buf, offs)
+        offs += 10
+        if rtype == 1 and rclass == 1 and rdlen == 4:
+            return "%d.%d.%d.%d" % tuple(buf[offs : offs + 4]), ttl
+        offs += rdlen  # CNAME etc.
+    return None
+
+
+class Resolver:
+    def __init__(self, server, port=53, timeout=2000, retries=2):
+        self._server = socket.getaddrinfo(server, port)[0][-1]  # Numeric: no lookup
+        self._timeout = timeout  # ms per attempt
+        self._retries = retries
+        self._cache = {}  # host: [address, expiry ticks]
+        self._qid = ticks_ms() & 0xFFFF
+
+    # Return seconds before cached entry expires (<= 0 if stale or absent).
+    def ttl(self, host):
+        if (entry := self._cache.get(host)) is None:
+            return 0
+        return ticks_diff(entry[1], ticks_ms()) // 1000
+
+    # Return the address of host. A fresh cache entry is returned immediately,
+    # otherwise the server is queried. On failure a stale entry is returned.
+    # Raises OSError if there is no address available.
+    async def resolve(self, host, refresh=False):
+        entry = self._cache.get(host)
+        if entry is not None and not refresh and ticks_diff(entry[1], ticks_ms()) > 0:
+            return entry[0]
+        res = await self._query(host)
+        if res is not None:
+            addr, ttl = res
+            expiry = ticks_add(ticks_ms(), max(ttl, TTL_MIN) * 1000)
+            if entry is None:
+                self._cache[host] = [addr, expiry]
+            else:
+                entry[0] = addr
+                entry[1] = expiry
+            return addr
+        if entry is not None:
+            return entry[0]  # Outage: use last known address
+        raise OSError(-1, "DNS lookup failed")
+
+    async def _query(self, host):
+        self._qid = (self._qid + 1) & 0xFFFF
+        qid = self._qid
+        pkt = query(host, qid)
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.setblocking(False)
+        try:
+            s.connect(self._server)
+            for _ in range(self._retries):
+                try:
+                    s.send(pkt)
+                except OSError:
+                    return None  # No route to server
+                t = ticks_ms()
+                while ticks_diff(ticks_ms(), t) < self._timeout:
+                    await asyncio.sleep_ms(20)
+                    try:
+                        buf = s.recv(512)
+                    except OSError as e:
+                        if e.args[0] != EAGAIN:
+                            return None
+                        continue
+                    try:
+                        if (res := parse(buf, qid)) is not None:
+                            return res
+                    except Exception:  # Truncated or malformed
+                        pass
+        finally:
+            s.close()
+        return None
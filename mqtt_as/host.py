@@ -0,0 +1,197 @@
+# host.py Host mode: run mqtt_as under CPython.
+
+# (C) Copyright Peter Hinch 2026.
+# Released under the MIT licence.
+
+# Imported by __init__.py when not running under MicroPython. Enables the
+# unmodified client to run on a PC, where it may be profiled with cProfile
+# and tracemalloc or tested at scale. Provides:
+# Stand-ins for the machine, network and micropython modules. The WLAN
+# interface is always connected.
+# The ticks functions and sleep_ms of MicroPython's time module,
+# asyncio.sleep_ms, asyncio.wait_for_ms, asyncio.ThreadSafeFlag, gc.mem_free
+# and gc.mem_alloc. These are added to the standard modules: nothing existing
+# is replaced.
+# socket and ssl namespaces whose sockets support the MicroPython stream
+# methods read, readinto and write, returning None where MicroPython's
+# nonblocking sockets would.
+# A StreamReader which waits on a socket.
+
+import asyncio
+import errno
+import gc
+import socket as _socket
+import sys
+import time
+from types import ModuleType
+from .tests.perf.fake import WLAN  # Shared with the unix port
+
+# MicroPython modules
+
+
+def _unique_id():
+    import uuid
+
+    return uuid.getnode().to_bytes(6, "big")  # MAC address
+
+
+def _install(name, **attrs):
+    if name not in sys.modules:  # Respect stand-ins provided by the application
+        m = ModuleType(name)
+        m.__dict__.update(attrs)
+        sys.modules[name] = m
+
+
+_install("machine", unique_id=_unique_id)
+_install("network", STA_IF=0, STAT_IDLE=1000, STAT_CONNECTING=1001, STAT_GOT_IP=1010, WLAN=WLAN)
+_install("micropython", const=lambda x: x, native=lambda f: f, viper=lambda f: f)
+
+# Additions to standard modules
+
+_TICKS_MAX = 0x3FFFFFFF
+_TICKS_HALF = 0x20000000
+_t0 = time.monotonic_ns()
+
+
+def ticks_diff(a, b):
+    d = (a - b) & _TICKS_MAX
+    return d - _TICKS_MAX - 1 if d & _TICKS_HALF else d
+
+
+class ThreadSafeFlag:  # .set() may be called from any thread.
+    def __init__(self):
+        self._flag = False
+        self._loop = None
+        self._fut = None
+
+    def set(self):
+        self._flag = True
+        if (loop := self._loop) is not None:
+            loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        if self._fut is not None and not self._fut.done():
+            self._fut.set_result(None)
+
+    def clear(self):
+        self._flag = False
+
+    async def wait(self):
+        self._loop = loop = asyncio.get_running_loop()
+        while not self._flag:
+            self._fut = loop.create_future()
+            if not self._flag:  # .set() may have run in another thread
+                await self._fut
+        self._flag = False
+
+
+def _mem_alloc():  # Only meaningful if tracemalloc is running.
+    import tracemalloc
+
+    return tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+
+
+for mod, name, func in (
+    (time, "ticks_ms", lambda: ((time.monotonic_ns() - _t0) // 1_000_000) & _TICKS_MAX),
+    (time, "ticks_us", lambda: ((time.monotonic_ns() - _t0) // 1000) & _TICKS_MAX),
+    (time, "ticks_diff", ticks_diff),
+    (time, "ticks_add", lambda a, b: (a + b) & _TICKS_MAX),
+    (time, "sleep_ms", lambda t: time.sleep(t / 1000)),
+    (asyncio, "sleep_ms", lambda t: asyncio.sleep(t / 1000)),
+    (asyncio, "wait_for_ms", lambda aw, t: asyncio.wait_for(aw, t / 1000)),
+    (asyncio, "ThreadSafeFlag", ThreadSafeFlag),
+    (gc, "mem_alloc", _mem_alloc),
+    (gc, "mem_free", lambda: 0),
+):
+    if not hasattr(mod, name):
+        setattr(mod, name, func)
+
+# Sockets
+
+
+def _buf(b, off, n):  # MicroPython's write(buf, off, n)
+    if isinstance(b, str):
+        b = b.encode()
+    mv = memoryview(b)[off:]
+    return mv if n is None else mv[:n]
+
+
+# MicroPython stream methods. None means "would block".
+class _Socket(_socket.socket):
+    def read(self, n=-1):
+        try:
+            return self.recv(n if n > 0 else 4096)
+        except BlockingIOError:
+            return None
+
+    def readinto(self, buf, n=None):
+        try:
+            return self.recv_into(buf, n or len(buf))
+        except BlockingIOError:
+            return None
+
+    def write(self, buf, off=0, n=None):
+        try:
+            return self.send(_buf(buf, off, n))
+        except BlockingIOError:
+            return None
+
+
+socket = ModuleType("socket")
+socket.__dict__.update({k: v for k, v in _socket.__dict__.items() if not k.startswith("__")})
+socket.socket = _Socket
+
+try:
+    import ssl as _ssl
+except ImportError:  # Python built without OpenSSL
+    ssl = None
+else:
+    _BUSY = (BlockingIOError, _ssl.SSLWantReadError, _ssl.SSLWantWriteError)
+
+    # SSLSocket.recv and .recv_into call .read, which is extended to return
+    # None rather than raise. On a closed socket MicroPython raises OSError.
+    class _SSLSocket(_ssl.SSLSocket):
+        def read(self, n=1024, buffer=None):
+            try:
+                return super().read(n, buffer)
+            except _BUSY:
+                return None
+            except ValueError:
+                raise OSError(errno.EBADF, "Socket closed")
+
+        def readinto(self, buf, n=None):
+            return self.read(n or len(buf), buf)
+
+        def write(self, buf, off=0, n=None):
+            try:
+                return super().write(_buf(buf, off, n))
+            except _BUSY:
+                return None
+            except ValueError:
+                raise OSError(errno.EBADF, "Socket closed")
+
+    class _SSLContext(_ssl.SSLContext):
+        sslsocket_class = _SSLSocket
+
+    ssl = ModuleType("ssl")
+    ssl.__dict__.update({k: v for k, v in _ssl.__dict__.items() if not k.startswith("__")})
+    ssl.SSLContext = _SSLContext
+
+
+class StreamReader:  # asyncio.StreamReader(sock) as used by MicroPython
+    def __init__(self, sock):
+        self._sock = sock
+
+    async def read(self, n):
+        loop = asyncio.get_running_loop()
+        fd = self._sock.fileno()
+        while True:
+            if (r := self._sock.read(n)) is not None:  # TLS may hold buffered data
+                return r
+            ready = loop.create_future()
+            loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+            try:
+                await ready
+            finally:
+                loop.remove_reader(fd)
+
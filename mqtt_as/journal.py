@@ -0,0 +1,157 @@
+# journal.py Power-loss-safe journal of outgoing qos==1 publications
+
+# (C) Copyright Peter Hinch 2026.
+# Released under the MIT licence.
+
+# Publications are appended to a file before being sent, and an ACK record is
+# appended when the broker acknowledges them. Records are accumulated in RAM
+# for BATCH_MS so that concurrent publications share one flash write. When no
+# publications are outstanding the file is truncated; if it grows beyond LIMIT
+# it is rewritten holding only unacknowledged publications. Rewriting is via
+# a temporary file so that power loss cannot lose records. On construction
+# any unacknowledged publications are read back for replay.
+
+import os
+import struct
+import asyncio
+from micropython import const
+
+BATCH_MS = 50  # Delay before writing a batch of records
+LIMIT = 16_384  # File size (bytes) which triggers compaction
+_PUB = const(0x50)  # "P" jid retain topic_len props_len msg_len topic props msg
+_ACK = const(0x41)  # "A" jid
+_PFMT = "!BIBHHI"
+_PLEN = const(14)
+
+
+class Journal:
+    def __init__(self, fname):
+        self._fname = fname
+        self._buf = bytearray()  # Records awaiting write
+        self._ids = set()  # IDs of unacknowledged publications
+        self._jid = 0
+        self._batch = 0  # Incremented when a batch is written
+        self._err = None
+        self._task = None
+        self._evt = asyncio.Event()
+        self.writes = 0  # No. of flash writes
+        self._pending = self._scan()
+        self._ids = {r[0] for r in self._pending}
+        self._rewrite(self._pending)  # Discard acknowledged records and any torn write
+
+    # Read the file. Return a list of unacknowledged publications in order.
+    def _scan(self):
+        recs = {}
+        try:
+            try:
+                f = open(self._fname, "rb")
+            except OSError:  # Power failed during a rewrite
+                f = open(self._fname + ".tmp", "rb")
+            with f:
+                while hdr := f.read(5):
+                    if len(hdr) < 5:
+                        break  # Torn write
+                    jid = struct.unpack_from("!I", hdr, 1)[0]
+                    self._jid = max(self._jid, jid)
+                    if hdr[0] == _ACK:
+                        recs.pop(jid, None)
+                        continue
+                    if hdr[0] != _PUB or len(h := f.read(_PLEN - 5)) < _PLEN - 5:
+                        break
+                    _, _, retain, tl, pl, ml = struct.unpack(_PFMT, hdr + h)
+                    data = f.read(tl + pl + ml)
+                    if len(data) < tl + pl + ml:
+                        break
+                    recs[jid] = (jid, data[:tl], data[tl + pl :], bool(retain), data[tl : tl + pl])
+        except OSError:  # No journal
+            pass
+        return sorted(recs.values())
+
+    def _rewrite(self, recs):
+        self._size = 0
+        tmp = self._fname + ".tmp"
+        with open(tmp, "wb") as f:
+            for jid, topic, msg, retain, props in recs:
+                f.write(struct.pack(_PFMT, _PUB, jid, retain, len(topic), len(props), len(msg)))
+                f.write(topic)
+                f.write(props)
+                f.write(msg)
+                self._size += _PLEN + len(topic) + len(props) + len(msg)
+        try:
+            os.rename(tmp, self._fname)
+        except OSError:  # FAT: target must not exist
+            try:
+                os.remove(self._fname)
+            except OSError:
+                pass
+            os.rename(tmp, self._fname)
+        self.writes += 1
+
+    # Return publications which were unacknowledged when the journal was
+    # opened, as (jid, topic, msg, retain, encoded properties) tuples. The
+    # list is returned once only.
+    def pending(self):
+        p = self._pending
+        self._pending = []
+        return p
+
+    # Add a publication. Return its ID once it has been written to flash.
+    # props are encoded properties (MQTTv5) or b"".
+    async def add(self, topic, msg, retain, props=b""):
+        self._jid += 1
+        jid = self._jid
+        b = self._buf
+        if isinstance(topic, str):  # Lengths are of the encoded bytes
+            topic = topic.encode()
+        if isinstance(msg, str):
+            msg = msg.encode()
+        b.extend(struct.pack(_PFMT, _PUB, jid, retain, len(topic), len(props), len(msg)))
+        b.extend(topic)
+        b.extend(props)
+        b.extend(msg)
+        self._ids.add(jid)
+        batch = self._batch
+        self._start()
+        while self._batch == batch:
+            await self._evt.wait()
+        if self._err is not None:
+            raise self._err
+        return jid
+
+    def ack(self, jid):  # Publication was acknowledged. No need to wait.
+        if jid in self._ids:
+            self._ids.discard(jid)
+            self._buf.extend(struct.pack("!BI", _ACK, jid))
+            self._start()
+
+    def _start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._write())
+
+    async def _write(self):
+        await asyncio.sleep_ms(BATCH_MS)  # Accumulate a batch
+        self._task = None
+        self._err = None
+        b = self._buf
+        try:
+            if not self._ids:  # Nothing outstanding: truncate
+                self._rewrite(())
+            elif self._size + len(b) > LIMIT:  # Compact
+                self._compact()
+            else:
+                with open(self._fname, "ab") as f:
+                    f.write(b)
+                self._size += len(b)
+                self.writes += 1
+        except OSError as e:
+            self._err = e
+        self._buf = bytearray()
+        self._batch += 1
+        self._evt.set()  # Wake tasks in .add()
+        self._evt.clear()
+
+    def _compact(self):  # Rewrite the file with only unacknowledged records.
+        with open(self._fname, "ab") as f:
+            f.write(self._buf)
+        ids = self._ids
+        self._rewrite([r for r in self._scan() if r[0] in ids])
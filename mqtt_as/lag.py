@@ -0,0 +1,129 @@
+# lag.py Scheduler lag monitor for mqtt_as
+
+# (C) Copyright Peter Hinch 2026.
+# Released under the MIT licence.
+
+# Instantiated by the client if config["lag_monitor"] is set. A task sleeps
+# for that period (ms) and measures how late it wakes: the lag is the time for
+# which other code held the scheduler. Lag percentiles are kept in a histogram
+# of bins about 19% wide, so they are accurate to that degree; the maximum is
+# exact. Blocking code may be timed as a named section:
+# with client.lag.section("scan"):
+#     wlan.scan()
+# The client times its own sections: "subs_cb" (the application's message
+# callback), "tls" (TLS handshake steps) and "zlib" (decompression). A lag of
+# STALL_MS or more is a stall. It is attributed to the section which ran for
+# the longest time since the monitor last woke, if that accounts for at least
+# half of the lag, otherwise to "other": application code not in a section.
+# The following entries of the client's metrics dict are updated:
+# lag_p50_us, lag_p90_us, lag_p99_us, lag_max_us Lag percentiles and maximum.
+# stalls {cause: [count, max_ms]}
+# sections {name: [count, total_us, max_us]}
+
+import asyncio
+from array import array
+from time import ticks_us, ticks_ms, ticks_diff
+
+STALL_MS = 50  # Lag treated as a stall
+UPDATE_MS = 1000  # Interval between updates of percentiles
+# Upper bounds of histogram bins (us): 100us to 100s, four per octave.
+_BOUNDS = array("I", (int(100 * 2 ** (i / 4)) for i in range(80)))
+
+
+class _Section:  # Context manager timing a block of code.
+    def __init__(self, monitor, name):
+        self._monitor = monitor
+        self._name = name
+        self._t = 0
+
+    def __enter__(self):
+        self._t = ticks_us()
+        return self
+
+    def __exit__(self, *_):
+        self._monitor.record(self._name, ticks_diff(ticks_us(), self._t))
+
+
+class Monitor:
+    def __init__(self, metrics, period):
+        self._metrics = metrics
+        self._period = period  # ms
+        self._bins = array("I", (0 for _ in range(len(_BOUNDS) + 1)))
+        self._n = 0  # Samples
+        self._max = 0  # Max lag (us)
+        self._top = None  # Section which ran longest since last wake
+        self._top_us = 0
+        self.stalls = {}
+        self.sections = {}
+        metrics["stalls"] = self.stalls
+        metrics["sections"] = self.sections
+
+    def section(self, name):  # Return a context manager timing a section.
+        return _Section(self, name)
+
+    def record(self, name, us):  # Account for a section which ran for us.
+        if (s := self.sections.get(name)) is None:
+            s = self.sections[name] = [0, 0, 0]
+        s[0] += 1
+        s[1] += us
+        if us > s[2]:
+            s[2] = us
+        if us > self._top_us:
+            self._top = name
+            self._top_us = us
+
+    def _add(self, lag):  # Add a sample (us) to the histogram.
+        lo, hi = 0, len(_BOUNDS)
+        while lo < hi:  # Find first bound >= lag
+            mid = (lo + hi) // 2
+            if _BOUNDS[mid] < lag:
+                lo = mid + 1
+            else:
+                hi = mid
+        self._bins[lo] += 1
+        self._n += 1
+        if lag > self._max:
+            self._max = lag
+
+    def _update(self):  # Write percentiles to metrics.
+        m = self._metrics
+        targets = ((50, "lag_p50_us"), (90, "lag_p90_us"), (99, "lag_p99_us"))
+        t = 0
+        count = 0
+        for i, n in enumerate(self._bins):
+            count += n
+            while t < len(targets) and count * 100 >= targets[t][0] * self._n:
+                m[targets[t][1]] = min(_BOUNDS[i] if i < len(_BOUNDS) else self._max, self._max)
+                t += 1
+        m["lag_max_us"] = self._max
+
+    def reset(self):  # Clear all data, e.g. after startup.
+        for i in range(len(self._bins)):
+            self._bins[i] = 0
+        self._n = self._max = 0
+        self._top = None
+        self._top_us = 0
+        self.stalls.clear()
+        self.sections.clear()
+        for k in ("lag_p50_us", "lag_p90_us", "lag_p99_us", "lag_max_us"):
+            self._metrics.pop(k, None)
+
+    # Runs while the client is in use.
+    async def run(self, client):
+        period = self._period
+        tu = ticks_ms()
+        while client._has_connected:
+            self._top_us = 0
+            t = ticks_us()
+            await asyncio.sleep_ms(period)
+            lag = max(ticks_diff(ticks_us(), t) - period * 1000, 0)
+            self._add(lag)
+            if lag >= STALL_MS * 1000:
+                cause = self._top if 2 * self._top_us >= lag else "other"
+                if (s := self.stalls.get(cause)) is None:
+                    s = self.stalls[cause] = [0, 0]
+                s[0] += 1
+                s[1] = max(s[1], lag // 1000)
+            if ticks_diff(ticks_ms(), tu) >= UPDATE_MS:
+                self._update()
+                tu = ticks_ms()
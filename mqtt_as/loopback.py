@@ -0,0 +1,142 @@
+# loopback.py In-memory transport for testing mqtt_as without a network
+
+# (C) Copyright Peter Hinch 2026.
+# Released under the MIT licence.
+
+# Loopback(server) is a transport whose connections are in-memory pipes. For
+# each connection server(stream) is called with the broker's end of the pipe.
+# By default this starts broker(), a minimal broker which acknowledges the
+# client's packets and returns its publications to it as if it had subscribed
+# to every topic. Tests and benchmarks can then run with no network. TLS and
+# will messages are ignored. The broker address is ignored, but
+# config["server"] must be numeric (e.g. "127.0.0.1") to avoid a DNS lookup.
+# If mss is set each read or write by the client transfers at most that many
+# bytes, as with a socket whose data arrive in segments.
+
+import asyncio
+from .transport import Socket
+from .codec import Parser, encode, encoded_size
+
+
+class Pipe:  # One end of an in-memory connection.
+    def __init__(self, mss=0):
+        self.peer = None
+        self._mss = mss  # Max bytes per write. 0: unlimited
+        self._buf = bytearray()  # Data awaiting read
+        self._eof = False  # Connection has closed
+        self._evt = asyncio.Event()  # Set when data arrives or the peer closes
+
+    def readinto(self, buf, n=None):
+        n = min(n or len(buf), len(self._buf))
+        if self._mss:
+            n = min(n, self._mss)
+        if not n:
+            return 0 if self._eof else None
+        buf[:n] = self._buf[:n]
+        del self._buf[:n]
+        return n
+
+    def read(self, n=-1):
+        if not self._buf:
+            return b"" if self._eof else None
+        n = len(self._buf) if n < 0 else min(n, len(self._buf))
+        if self._mss:
+            n = min(n, self._mss)
+        r = bytes(self._buf[:n])
+        del self._buf[:n]
+        return r
+
+    def write(self, buf, off=0, n=None):
+        if self._eof:
+            raise OSError(-1, "Connection closed by peer")
+        end = len(buf) if n is None else off + n
+        if self._mss:
+            end = min(end, off + self._mss)
+        mv = memoryview(buf)[off:end]
+        self.peer._buf.extend(mv)
+        self.peer._evt.set()
+        return len(mv)
+
+    def close(self):
+        self._eof = True  # Further writes fail
+        self.peer._eof = True
+        self.peer._evt.set()
+
+
+class _Reader:  # Awaits data on a Pipe.
+    def __init__(self, pipe):
+        self._pipe = pipe
+
+    async def read(self, n):
+        while (r := self._pipe.read(n)) is None:
+            self._pipe._evt.clear()
+            await self._pipe._evt.wait()
+        return r
+
+
+class Loopback(Socket):
+    def __init__(self, server=None, mss=0):
+        super().__init__()
+        self._server = server or (lambda s: asyncio.create_task(broker(s)))
+        self._mss = mss
+        self.connections = 0
+
+    def open(self, addr):
+        client, server = Pipe(self._mss), Pipe()
+        client.peer = server
+        server.peer = client
+        self.connections += 1
+        self._server(server)
+        return client
+
+    def reader(self, stream):
+        return _Reader(stream)
+
+
+def _send(stream, hdr, pid=0, topic=None, msg=None, props=None):
+    buf = bytearray(encoded_size(hdr, pid, topic, msg, props))
+    stream.write(buf, 0, encode(buf, 0, hdr, pid, topic, msg, props))
+
+
+async def broker(stream):  # Serve one connection.
+    reader = _Reader(stream)
+    parser = Parser()
+    v5 = False
+    pid = 0  # Broker's PIDs are independent of the client's
+    while data := await reader.read(1024):
+        data = memoryview(data)
+        while data:
+            ev, n = parser.feed(data)
+            data = data[n:]
+            if ev is None:
+                continue
+            typ = ev[0]
+            if typ == 0x10:  # CONNECT: the protocol level sets the version
+                if v5 := ev[1][6] == 5:
+                    from .mqtt_v5_properties import encode_properties
+
+                    parser = Parser(True)
+                stream.write(b"\x20\x03\x00\x00\x00" if v5 else b"\x20\x02\x00\x00")
+            elif typ == 0x80 or typ == 0xA0:  # [UN]SUBSCRIBE: grant qos requested
+                body = ev[1]
+                ack = bytearray(b"\x90\x03" if typ == 0x80 else b"\xb0\x02")
+                ack.extend(body[:2])  # PID
+                if v5:
+                    ack[1] += 1 if typ == 0x80 else 2
+                    ack.append(0)  # No properties
+                if typ == 0x80 or v5:
+                    ack.append(body[-1] & 3 if typ == 0x80 else 0)
+                stream.write(ack)
+            elif typ == 0xC0:  # PINGREQ
+                stream.write(b"\xd0\x00")
+            elif typ == 0xE0:  # DISCONNECT
+                stream.close()
+                return
+            elif typ == 0x30:  # PUBLISH: acknowledge then return to client
+                _, op, ppid, topic, msg, props = ev
+                if qos := op >> 1 & 3:
+                    _send(stream, 0x40, ppid)
+                    pid = pid % 65535 + 1
+                props = encode_properties(props) if v5 else None
+                _send(stream, 0x30 | qos << 1, pid if qos else 0, topic, msg, props)
+    stream.close()
@@ -78,8 +78,8 @@ ENCODE_TABLE = {
 # Exceptions from connectivity failures are handled by MQTTClient subclass.
 def encode_properties(properties: dict):
     # If properties are empty or None, we can just return a single byte (0)
-    if properties in (None, {}):
-        return bytes(1)
+    if not properties:
+        return b"\0"
 
     # We can't modify the properties dict, as user might want to use it later
     # So we will create a new dict with the encoded values.
@@ -188,6 +188,33 @@ def decode_variable_byte_int(props, offset):
     return value, offset
 
 
+# Where the port has the viper and native emitters native.py replaces the above
+# integer and string codecs. PURE holds the Python versions for
+# tests/perf/native.py.
+PURE = {
+    "encode_variable_byte_int": encode_variable_byte_int,
+    "decode_byte": decode_byte,
+    "decode_two_byte_int": decode_two_byte_int,
+    "decode_four_byte_int": decode_four_byte_int,
+    "decode_variable_byte_int": decode_variable_byte_int,
+    "decode_string": decode_string,
+    "decode_binary": decode_binary,
+}
+try:
+    from .native import (  # noqa: F811
+        encode_variable_byte_int,
+        decode_byte,
+        decode_two_byte_int,
+        decode_four_byte_int,
+        decode_variable_byte_int,
+        decode_string,
+        decode_binary,
+    )
+
+    ENCODE_TABLE[0x0B] = encode_variable_byte_int
+except Exception:  # No emitters, or CPython
+    pass
+
 decode_property_lookup = {
     0x01: decode_byte,  # Payload Format Indicator
     0x02: decode_four_byte_int,  # Message Expiry Interval
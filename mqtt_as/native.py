@@ -0,0 +1,121 @@
+# native.py Machine code versions of mqtt_as byte codecs
+
+# (C) Copyright Peter Hinch 2026.
+# Released under the MIT licence.
+
+# Drop-in replacements for the VBI functions in codec.py and the integer and
+# string decoders in mqtt_v5_properties.py, compiled by MicroPython's viper and
+# native emitters. Those modules import them where the port supports the
+# emitters; elsewhere (including CPython) importing this module fails and the
+# Python versions are used. Viper pointers are not bounds checked, so lengths
+# are checked explicitly: truncated data raise IndexError or ValueError as the
+# Python versions do. See tests/perf/native.py.
+
+import micropython
+
+
+# codec.py
+
+
+@micropython.viper
+def vbi(buf, offs: int, x: uint) -> int:
+    p = ptr8(buf)
+    n = int(len(buf))
+    while True:
+        if offs >= n:
+            raise IndexError
+        if x > uint(0x7F):
+            p[offs] = (x & uint(0x7F)) | uint(0x80)
+            x >>= 7
+            offs += 1
+        else:
+            p[offs] = x
+            return offs + 1
+
+
+@micropython.viper
+def vbi_len(x: uint) -> int:
+    n = 1
+    while x > uint(0x7F):
+        x >>= 7
+        n += 1
+    return n
+
+
+# mqtt_v5_properties.py Decoders return (value, next offset).
+
+
+@micropython.viper
+def encode_variable_byte_int(value: uint):
+    n = 1  # Encoding is truncated to 4 bytes
+    while n < 4 and (value >> (7 * n)):
+        n += 1
+    out = bytearray(n)
+    p = ptr8(out)
+    i = 0
+    while i < n:
+        b = (value >> (7 * i)) & 0x7F
+        if value >> (7 * (i + 1)):
+            b |= 0x80
+        p[i] = b
+        i += 1
+    return out
+
+
+@micropython.viper
+def decode_byte(props, offset: int):
+    if offset >= int(len(props)):
+        raise IndexError
+    p = ptr8(props)
+    return p[offset], offset + 1
+
+
+@micropython.viper
+def decode_two_byte_int(props, offset: int):
+    if offset + 2 > int(len(props)):
+        raise ValueError
+    p = ptr8(props)
+    return p[offset] << 8 | p[offset + 1], offset + 2
+
+
+@micropython.viper
+def decode_four_byte_int(props, offset: int):
+    if offset + 4 > int(len(props)):
+        raise ValueError
+    p = ptr8(props)
+    v = uint(p[offset]) << 24 | uint(p[offset + 1]) << 16 | uint(p[offset + 2]) << 8 | uint(p[offset + 3])
+    return v, offset + 4
+
+
+@micropython.viper
+def decode_variable_byte_int(props, offset: int):
+    p = ptr8(props)
+    n = int(len(props))
+    value = 0
+    sh = 0
+    while sh < 28:  # At most 4 bytes
+        if offset >= n:
+            raise IndexError
+        b = p[offset]
+        offset += 1
+        value |= (b & 0x7F) << sh
+        if (b & 0x80) == 0:
+            break
+        sh += 7
+    return value, offset
+
+
+@micropython.native
+def decode_string(props, offset):
+    if offset + 2 > len(props):
+        raise ValueError
+    end = offset + 2 + (props[offset] << 8 | props[offset + 1])
+    return props[offset + 2 : end].decode("utf-8"), end
+
+
+@micropython.native
+def decode_binary(props, offset):
+    if offset + 2 > len(props):
+        raise ValueError
+    end = offset + 2 + (props[offset] << 8 | props[offset + 1])
+    return props[offset + 2 : end], end
@@ -0,0 +1,83 @@
+# shaper.py Publication rate limiting for mqtt_as
+
+# (C) Copyright Peter Hinch 2026.
+# Released under the MIT licence.
+
+# Token buckets limit the rate of publication in messages/s and bytes/s. A
+# publication which would exceed a limit is delayed until tokens are
+# available: the publishing task sleeps for the computed time rather than
+# polling. Buckets apply to topics with a given prefix: the prefix "" applies
+# to all publications, providing a per-client limit.
+
+import asyncio
+from time import ticks_ms, ticks_diff
+
+
+# Tokens are held in thousandths, and the rate in thousandths per second, so
+# that a fractional rate (e.g. 0.2 msgs/s) needs no floating point at runtime.
+# The part of a thousandth accrued but not yet added is carried in ._rem.
+class TokenBucket:
+    def __init__(self, rate, burst=1):  # Tokens/s, capacity in secs of rate
+        self._rate = max(int(rate * 1000), 1)
+        self._cap = int(rate * burst * 1000)
+        self._tokens = self._cap
+        self._rem = 0
+        self._t = ticks_ms()
+
+    def _fill(self):
+        t = ticks_ms()
+        x = ticks_diff(t, self._t) * self._rate + self._rem
+        self._t = t
+        self._rem = x % 1000
+        self._tokens = min(self._cap, self._tokens + x // 1000)
+
+    # Return ms until n tokens are available. A request larger than the
+    # capacity is granted when the bucket is full.
+    def delay(self, n):
+        self._fill()
+        need = min(n * 1000, self._cap) - self._tokens
+        return 0 if need <= 0 else (need * 1000 - self._rem + self._rate - 1) // self._rate
+
+    def take(self, n):  # May leave the bucket in debt.
+        self._tokens -= n * 1000
+
+
+class Shaper:
+    # limits: {prefix: (msgs/s, bytes/s[, burst secs])}. A rate of 0 is
+    # unlimited.
+    def __init__(self, limits):
+        self._buckets = []
+        for prefix, lim in limits.items():
+            burst = lim[2] if len(lim) > 2 else 1
+            msgs = TokenBucket(lim[0], burst) if lim[0] else None
+            nbytes = TokenBucket(lim[1], burst) if lim[1] else None
+            if isinstance(prefix, str):
+                self._buckets.append((prefix, prefix.encode(), msgs, nbytes))
+            else:
+                self._buckets.append((bytes(prefix).decode(), bytes(prefix), msgs, nbytes))
+
+    def _delay(self, topic, n):
+        d = 0
+        s = isinstance(topic, str)
+        for sp, bp, msgs, nbytes in self._buckets:
+            if topic.startswith(sp if s else bp):
+                if msgs is not None:
+                    d = max(d, msgs.delay(1))
+                if nbytes is not None:
+                    d = max(d, nbytes.delay(n))
+        return d
+
+    # Wait until a message of n bytes may be published to topic, then
+    # consume its tokens. Return the time waited (ms).
+    async def wait(self, topic, n):
+        t = ticks_ms()
+        while d := self._delay(topic, n):
+            await asyncio.sleep_ms(d)
+        s = isinstance(topic, str)
+        for sp, bp, msgs, nbytes in self._buckets:
+            if topic.startswith(sp if s else bp):
+                if msgs is not None:
+                    msgs.take(1)
+                if nbytes is not None:
+                    nbytes.take(n)
+        return ticks_diff(ticks_ms(), t)
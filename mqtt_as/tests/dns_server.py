@@ -0,0 +1,58 @@
+# tests/dns_server.py Stand-in DNS server for testing the mqtt_as resolver.
+
+# (C) Copyright Peter Hinch 2026.
+# Released under the MIT licence.
+
+# Answers A queries from a dict. Runs under CPython or the MicroPython unix
+# port. Changing .records at runtime simulates a DNS failover; setting .down
+# simulates an outage. Run standalone with
+# micropython mqtt_as/tests/dns_server.py
+# and configure the client with
+# config["dns_server"] = ("127.0.0.1", 5353)
+
+import socket
+import struct
+import asyncio
+
+
+class DNSServer:
+    def __init__(self, records, ttl=60, port=5353):
+        self.records = records  # {"broker.example": "192.168.0.10"}
+        self.ttl = ttl
+        self.down = False
+        self.queries = 0
+        self._sock = s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind(socket.getaddrinfo("127.0.0.1", port)[0][-1])
+        s.setblocking(False)
+
+    def response(self, q):
+        offs = 12
+        labels = []
+        while n := q[offs]:
+            labels.append(bytes(q[offs + 1 : offs + 1 + n]).decode())
+            offs += n + 1
+        offs += 5  # Root label, QTYPE, QCLASS
+        addr = self.records.get(".".join(labels))
+        hdr = struct.pack("!HHHHHH", q[0] << 8 | q[1], 0x8180 if addr else 0x8183, 1, 1 if addr else 0, 0, 0)
+        if addr is None:
+            return hdr + q[12:offs]
+        rr = struct.pack("!HHHIH", 0xC00C, 1, 1, self.ttl, 4) + bytes(int(x) for x in addr.split("."))
+        return hdr + q[12:offs] + rr
+
+    async def run(self):
+        s = self._sock
+        while True:
+            await asyncio.sleep(0.01)
+            try:
+                q, addr = s.recvfrom(512)
+            except OSError:
+                continue
+            self.queries += 1
+            if not self.down:
+                s.sendto(self.response(q), addr)
+
+
+if __name__ == "__main__":
+    print("DNS server on port 5353: broker.local -> 127.0.0.1")
+    asyncio.run(DNSServer({"broker.local": "127.0.0.1"}, ttl=30).run())
@@ -0,0 +1,77 @@
+# tests/perf/alloc.py Check steady state allocation in static memory mode.
+
+# (C) Copyright Peter Hinch 2026.
+# Released under the MIT licence.
+
+# Performs qos==0 publish/receive cycles through a broker on localhost and
+# asserts that heap usage does not grow. Also reports bytes allocated per
+# cycle with two payload sizes: with static_mem these must match, showing
+# that no allocation depends on message size. Run from the repository root
+# on the unix port with
+# micropython mqtt_as/tests/perf/alloc.py [cycles]
+
+import sys
+
+sys.path.insert(1, "")  # Repository root
+import fake
+
+fake.install()
+import asyncio
+import gc
+from mqtt_as import MQTTClient, config
+
+TOPIC = "alloc_test"
+SLACK = 64  # Permitted heap growth (bytes)
+received = asyncio.Event()
+
+
+def sub_cb(topic, msg, retained):
+    received.set()
+
+
+async def cycle(client, payload):
+    await client.publish(TOPIC, payload)
+    await received.wait()
+    received.clear()
+
+
+async def per_cycle(client, payload, n=100):  # Bytes allocated per cycle
+    gc.collect()
+    gc.disable()
+    a = gc.mem_alloc()
+    for _ in range(n):
+        await cycle(client, payload)
+    a = gc.mem_alloc() - a
+    gc.enable()
+    return a // n
+
+
+async def main(cycles):
+    config["server"] = "127.0.0.1"
+    config["ibuf_size"] = 1100
+    config["subs_cb"] = sub_cb
+    config["static_mem"] = True
+    client = MQTTClient(config)
+    await client.connect(quick=True)
+    await client.subscribe(TOPIC, 0)
+    small = b"x" * 16
+    large = b"y" * 1024
+    for _ in range(100):  # Reach steady state
+        await cycle(client, large)
+    gc.collect()
+    start = gc.mem_alloc()
+    for n in range(cycles):
+        await cycle(client, large if n & 1 else small)
+    gc.collect()
+    growth = gc.mem_alloc() - start
+    a_small = await per_cycle(client, small)
+    a_large = await per_cycle(client, large)
+    await client.disconnect()
+    print(f"{cycles} cycles: heap growth {growth} bytes")
+    print(f"Allocated per cycle: {a_small} bytes (16 byte payload) {a_large} bytes (1KiB payload)")
+    assert growth <= SLACK, "Heap grew"
+    assert a_large - a_small < 16, "Allocation depends on message size"
+    print("PASS")
+
+
+asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000))
@@ -0,0 +1,70 @@
+# tests/perf/codec.py Throughput of the sans-IO packet encoder and parser.
+
+# (C) Copyright Peter Hinch 2026.
+# Released under the MIT licence.
+
+# Encodes a stream of PUBLISH packets into a buffer, then parses it back in
+# chunks of several sizes, checking every event. Reports packets/s for each
+# MQTT version and payload size. No broker or socket is needed. Run from the
+# repository root on the unix port with
+# micropython mqtt_as/tests/perf/codec.py [packets]
+# or under CPython (host mode).
+
+import sys
+
+sys.path.insert(1, "")  # Repository root
+if sys.implementation.name == "micropython":
+    import fake
+
+    fake.install()
+import mqtt_as  # noqa: F401 Host mode: provides ticks functions
+from mqtt_as.codec import Parser, encode, encoded_size, PUBLISH
+from time import ticks_ms, ticks_diff
+
+TOPIC = b"perf/codec"
+PROPS = b"\x07\x01\x01\x02\x00\x00\x0e\x10"  # Payload format, message expiry
+
+
+def stream(count, size, v5):  # Return a buffer holding count publications
+    payload = b"x" * size
+    props = PROPS if v5 else None
+    n = sum(encoded_size(0x30 | (p & 1) << 1, p & 1 and p, TOPIC, payload, props) for p in range(1, count + 1))
+    buf = bytearray(n)
+    offs = 0
+    t = ticks_ms()
+    for pid in range(1, count + 1):  # Alternate qos 0 and 1
+        offs = encode(buf, offs, 0x30 | (pid & 1) << 1, pid & 1 and pid, TOPIC, payload, props)
+    dt = max(ticks_diff(ticks_ms(), t), 1)
+    return buf, count * 1000 // dt
+
+
+def parse(buf, chunk, count, size, v5):  # Return packets/s
+    p = Parser(v5, size + 50)
+    mv = memoryview(buf)
+    n = offs = 0
+    t = ticks_ms()
+    while offs < len(buf):
+        data = mv[offs : offs + chunk]
+        offs += len(data)
+        while data:
+            ev, used = p.feed(data)
+            data = data[used:]
+            if ev is not None:
+                n += 1
+                assert ev[0] == PUBLISH and ev[2] == (n & 1 and n) and len(ev[4]) == size
+                assert bytes(ev[3]) == TOPIC and (ev[5] is not None) == v5
+    dt = max(ticks_diff(ticks_ms(), t), 1)
+    assert n == count
+    return count * 1000 // dt
+
+
+def main(count):
+    print("Version  Payload  Encode/s  Parse/s: chunk 64  1460  all")
+    for v5 in (False, True):
+        for size in (16, 1024):
+            buf, enc = stream(count, size, v5)
+            rates = [parse(buf, c, count, size, v5) for c in (64, 1460, len(buf))]
+            print(f"{'v5' if v5 else 'v3':>7s} {size:8d} {enc:9d} {rates[0]:15d} {rates[1]:5d} {rates[2]:5d}")
+
+
+main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,70 @@
+# tests/perf/fake.py Stand-ins for hardware modules.
+
+# (C) Copyright Peter Hinch 2026.
+# Released under the MIT licence.
+
+# Allows mqtt_as to run on the unix port, which lacks network.WLAN,
+# machine.unique_id and aioespnow. install() must be called before importing
+# mqtt_as.
+# WLAN is also the stand-in installed by host.py under CPython.
+
+import sys
+
+
+class WLAN:  # Always connected
+    PM_NONE = 0
+
+    def __init__(self, *_):
+        pass
+
+    def active(self, *_):
+        return True
+
+    def isconnected(self):
+        return True
+
+    def connect(self, *_):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def status(self, *_):
+        return 1010  # STAT_GOT_IP
+
+    def config(self, *_, **__):
+        return 0
+
+    def ifconfig(self):
+        return ("127.0.0.1", "255.0.0.0", "127.0.0.1", "127.0.0.1")
+
+
+class network:
+    STA_IF = 0
+    STAT_IDLE = 1000
+    STAT_CONNECTING = 1001
+    WLAN = WLAN
+
+
+class machine:
+    @staticmethod
+    def unique_id():
+        return b"\xde\xad\xbe\xef"
+
+
+class AIOESPNow:  # Gateway mode: instantiated but not used
+    def active(self, *_):
+        return True
+
+
+class aioespnow:
+    AIOESPNow = AIOESPNow
+
+
+def install():
+    sys.modules["network"] = network
+    sys.modules["aioespnow"] = aioespnow
+    try:
+        from machine import unique_id
+    except ImportError:
+        sys.modules["machine"] = machine
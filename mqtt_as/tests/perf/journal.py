@@ -0,0 +1,77 @@
+# tests/perf/journal.py Throughput of the qos==1 publication journal.
+
+# (C) Copyright Peter Hinch 2026.
+# Released under the MIT licence.
+
+# Concurrent tasks each journal a publication, hold it unacknowledged for a
+# simulated round trip time, then acknowledge it. Reports publications/s and
+# the number of file writes for several levels of concurrency. First checks
+# that unacknowledged publications with non-ASCII str topic and payload are
+# replayed intact, followed by later records. No broker is needed. Run from the
+# repository root on the unix port with
+# micropython mqtt_as/tests/perf/journal.py [secs]
+
+import sys
+
+sys.path.insert(1, "")  # Repository root
+import asyncio
+import os
+import mqtt_as  # noqa: F401 Host mode: provides ticks functions
+from time import ticks_ms, ticks_diff
+from mqtt_as.journal import Journal
+
+FNAME = "/tmp/mqtt_as_journal"
+RTT = 20  # Simulated broker round trip time (ms)
+
+
+async def publisher(j, payload, count, stop):
+    while not stop:
+        jid = await j.add("perf/journal", payload, False)
+        await asyncio.sleep_ms(RTT)
+        j.ack(jid)
+        count[0] += 1
+
+
+async def replay():  # Return True if a journal reopened after "power loss" is intact.
+    for f in (FNAME, FNAME + ".tmp"):
+        try:
+            os.remove(f)
+        except OSError:
+            pass
+    pubs = [("perf/température", "22.5°C ✓", True, b""), ("perf/b", b"\x00\xff", False, b"\x02\x00\x00\x00\x3c")]
+    j = Journal(FNAME)
+    for topic, msg, retain, props in pubs:
+        await j.add(topic, msg, retain, props)
+    want = [(t.encode() if isinstance(t, str) else t, m.encode() if isinstance(m, str) else m, r, p) for t, m, r, p in pubs]
+    return [r[1:] for r in Journal(FNAME).pending()] == want
+
+
+async def run(tasks, size, secs):
+    j = Journal(FNAME)
+    j.writes = 0
+    count = [0]
+    stop = []
+    payload = b"x" * size
+    t = [asyncio.create_task(publisher(j, payload, count, stop)) for _ in range(tasks)]
+    start = ticks_ms()
+    await asyncio.sleep(secs)
+    stop.append(True)
+    await asyncio.gather(*t)
+    dt = ticks_diff(ticks_ms(), start) / 1000
+    n = count[0]
+    print(f"{tasks:3d} tasks {size:5d} bytes: {n / dt:7.0f} pubs/s {j.writes / dt:5.1f} writes/s {n / max(j.writes, 1):5.1f} pubs/write")
+
+
+async def main(secs):
+    print("Replay:", "OK" if await replay() else "FAIL")
+    for tasks in (1, 4, 16):
+        for size in (64, 1024):
+            await run(tasks, size, secs)
+    for f in (FNAME, FNAME + ".tmp"):
+        try:
+            os.remove(f)
+        except OSError:
+            pass
+
+
+asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5))
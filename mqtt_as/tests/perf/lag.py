@@ -0,0 +1,79 @@
+# tests/perf/lag.py Scheduler lag and its attribution.
+
+# (C) Copyright Peter Hinch 2026.
+# Released under the MIT licence.
+
+# Runs a client with the lag monitor over loopback.py. The client publishes to a
+# topic to which it subscribes. Its subs_cb blocks for CB_MS on every tenth
+# message, and an application task blocks for APP_MS at intervals, once inside
+# a named section and once outside any section. Prints the lag percentiles,
+# stalls by cause and section times. Expect stalls attributed to "subs_cb",
+# "scan" and "other". Run from the repository root on the unix port with
+# micropython mqtt_as/tests/perf/lag.py [messages]
+# or under CPython (host mode).
+
+import sys
+
+sys.path.insert(1, "")  # Repository root
+if sys.implementation.name == "micropython":
+    import fake
+
+    fake.install()
+import asyncio
+import mqtt_as  # noqa: F401 Host mode: provides ticks functions
+from time import sleep_ms
+from mqtt_as import MQTTClient, config
+from mqtt_as.loopback import Loopback
+
+TOPIC = "lag"
+PERIOD = 10  # Monitor period (ms)
+CB_MS = 80  # Callback blocks for this long
+APP_MS = 120  # Application blocks for this long
+
+
+async def hog(client, done):  # Application task.
+    while not done[0]:
+        await asyncio.sleep_ms(300)
+        with client.lag.section("scan"):
+            sleep_ms(APP_MS)
+        await asyncio.sleep_ms(300)
+        sleep_ms(APP_MS)  # Not in a section
+
+
+async def main(count):
+    received = [0]
+    done = [False]
+
+    def sub_cb(topic, msg, retained):
+        received[0] += 1
+        if not received[0] % 10:
+            sleep_ms(CB_MS)
+
+    config["server"] = "127.0.0.1"
+    config["subs_cb"] = sub_cb
+    config["transport"] = Loopback()
+    config["lag_monitor"] = PERIOD
+    client = MQTTClient(config)
+    await client.connect(quick=True)
+    await client.subscribe(TOPIC, 0)
+    asyncio.create_task(hog(client, done))
+    for n in range(count):
+        await client.publish(TOPIC, f"message {n}")
+        await asyncio.sleep_ms(20)
+    while received[0] < count:
+        await asyncio.sleep_ms(10)
+    await asyncio.sleep_ms(1100)  # Final percentile update
+    done[0] = True
+    m = client.metrics
+    print(f"{count} messages, monitor period {PERIOD}ms")
+    print(f"Lag us: p50 {m['lag_p50_us']} p90 {m['lag_p90_us']} p99 {m['lag_p99_us']} max {m['lag_max_us']}")
+    print("Stall cause  Count  Max ms")
+    for k, (n, ms) in sorted(m["stalls"].items()):
+        print(f"{k:12s} {n:5d} {ms:7d}")
+    print("Section  Count  Total us  Max us")
+    for k, (n, tot, mx) in sorted(m["sections"].items()):
+        print(f"{k:8s} {n:5d} {tot:9d} {mx:7d}")
+    await client.disconnect()
+
+
+asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100))
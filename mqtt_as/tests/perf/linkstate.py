@@ -0,0 +1,100 @@
+# tests/perf/linkstate.py Cost of link state checks in the client's I/O loops.
+
+# (C) Copyright Peter Hinch 2026.
+# Released under the MIT licence.
+
+# The read and write loops check the link once per chunk transferred. This
+# publishes long messages over loopback.py, in segments of MSS bytes, to a
+# topic to which the client subscribes. It counts the link queries reaching
+# the transport with the cache disabled (LINK_MS = 0) and with the default
+# LINK_MS. Each query calls WLAN.isconnected(): on hardware this is the WiFi
+# driver. Elsewhere a driver cost may be emulated with --cost=us. Run from the
+# repository root on the unix port with
+# micropython mqtt_as/tests/perf/linkstate.py [messages] [--cost=us]
+# or under CPython (host mode).
+
+import sys
+
+sys.path.insert(1, "")  # Repository root
+if sys.implementation.name == "micropython":
+    import fake
+
+    fake.install()
+import asyncio
+import mqtt_as
+import network  # After mqtt_as: host mode provides a stand-in
+from time import ticks_ms, ticks_us, ticks_diff
+from mqtt_as import MQTTClient, config
+from mqtt_as.loopback import Loopback
+
+TOPIC = "linkstate"
+SIZE = 8192  # Message size
+MSS = 536  # Bytes per read or write
+
+
+class Counting(Loopback):  # Counts link queries. Emulates a driver's cost.
+    def __init__(self, cost):
+        super().__init__(mss=MSS)
+        self._nic = network.WLAN(network.STA_IF)
+        self._cost = cost
+        self.n = 0
+
+    def isconnected(self):
+        self.n += 1
+        if self._cost:
+            t = ticks_us()
+            while ticks_diff(ticks_us(), t) < self._cost:
+                pass
+        return self._nic.isconnected()
+
+
+def query_us(transport):  # Mean time per query (us)
+    n = 1000
+    t = ticks_us()
+    for _ in range(n):
+        transport.isconnected()
+    return ticks_diff(ticks_us(), t) / n
+
+
+async def run(count, link_ms, cost):  # Return (ms, queries, mean query us)
+    mqtt_as.LINK_MS = link_ms
+    mqtt_as.IBUFSIZE = SIZE + 100
+    received = [0]
+
+    def sub_cb(topic, msg, retained):
+        received[0] += 1
+
+    transport = Counting(cost)
+    us = query_us(transport)
+    transport.n = 0
+    config["server"] = "127.0.0.1"
+    config["subs_cb"] = sub_cb
+    config["transport"] = transport
+    client = MQTTClient(config)
+    await client.connect(quick=True)
+    await client.subscribe(TOPIC, 0)
+    payload = b"x" * SIZE
+    n = transport.n
+    t = ticks_ms()
+    for _ in range(count):
+        await client.publish(TOPIC, payload)
+    while received[0] < count:
+        await asyncio.sleep_ms(0)
+    dt = max(ticks_diff(ticks_ms(), t), 1)
+    n = transport.n - n
+    await client.disconnect()
+    return dt, n, us
+
+
+async def main(count, cost):
+    kib = 2 * count * SIZE / 1024  # Sent and received
+    print(f"{count} messages of {SIZE} bytes in {MSS} byte segments, {kib:.0f} KiB")
+    print("LINK_MS  KiB/s  Queries  Queries/KiB  Query us  Query us/KiB")
+    for link_ms in (0, 100):
+        dt, n, us = await run(count, link_ms, cost)
+        print(f"{link_ms:7d} {kib * 1000 / dt:6.0f} {n:8d} {n / kib:12.2f} {us:9.1f} {n * us / kib:13.1f}")
+
+
+args = [a for a in sys.argv[1:] if not a.startswith("--")]
+cost = [int(a[7:]) for a in sys.argv[1:] if a.startswith("--cost=")]
+asyncio.run(main(int(args[0]) if args else 200, cost[0] if cost else 0))
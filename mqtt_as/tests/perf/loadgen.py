@@ -0,0 +1,170 @@
+# tests/perf/loadgen.py Many-client load generator.
+
+# (C) Copyright Peter Hinch 2026.
+# Released under the MIT licence.
+
+# Runs many independent MQTTClient instances in one event loop against a
+# broker, as described by a JSON scenario file (see scenario.json). Each group
+# of clients publishes at a given rate per client, with a given fraction of
+# qos==1 messages and a payload size (fixed, or a [min, max] range). Clients
+# may subscribe to topics: the number of subscribing clients determines the
+# fan-out. Payloads carry a timestamp so that end to end latency is measured.
+# Reports, per group, throughput, publish latency (time for publish() to
+# return: for qos==1 this includes the PUBACK), end to end latency, and
+# reconnections. Memory per client is the heap growth from instantiating and
+# connecting the clients.
+# Runs on the unix port or under CPython (host mode). Start from the repository
+# root with e.g.
+# micropython mqtt_as/tests/perf/loadgen.py mqtt_as/tests/perf/scenario.json
+# python3 mqtt_as/tests/perf/loadgen.py mqtt_as/tests/perf/scenario.json
+# Each client uses one socket: large scenarios may need "ulimit -n" raising.
+# Scenario keys:
+# server, port, mqttv5: Broker. duration: Secs. ramp: Connections per sec.
+# groups: list of dicts with keys
+#   name, clients: Group name and number of clients.
+#   rate: Publications per sec per client (0: none).
+#   qos1: Fraction of publications with qos==1.
+#   size: Payload bytes, or [min, max]. Minimum 4.
+#   topic: Publication topic. {n} is replaced by the client number.
+#   subscribe: List of topics to subscribe to with qos==1.
+
+import sys
+
+sys.path.insert(1, "")  # Repository root
+if sys.implementation.name == "micropython":
+    import fake
+
+    fake.install()
+try:
+    import tracemalloc  # CPython: gc.mem_alloc reports traced memory
+
+    tracemalloc.start()
+except ImportError:
+    pass
+import mqtt_as  # Under CPython adds ticks functions to time
+from mqtt_as import MQTTClient, config
+import asyncio
+import gc
+import json
+import random
+import struct
+from time import ticks_ms, ticks_diff
+
+
+class Group:
+    def __init__(self, d):
+        self.name = d["name"]
+        self.clients = d["clients"]
+        self.rate = d.get("rate", 0)
+        self.qos1 = d.get("qos1", 0)
+        size = d.get("size", 16)
+        self.size = (size, size) if isinstance(size, int) else tuple(size)
+        if self.size[0] < 4:
+            raise ValueError("Minimum payload size is 4.")
+        self.topic = d.get("topic", "load/" + self.name + "/{n}")
+        self.subscribe = d.get("subscribe", ())
+        self.pubs = 0  # Publications made
+        self.nbytes = 0  # Payload bytes published
+        self.rx = 0  # Messages received
+        self.pub_ms = []  # Publish latency
+        self.e2e_ms = []  # End to end latency
+        self.connects = 0  # Connections by all clients
+        self.failed = 0  # Clients which failed to connect
+
+
+def percentiles(v):  # p50 p90 p99 max
+    if not v:
+        return f"{'-':>5s} {'-':>5s} {'-':>5s} {'-':>6s}"
+    v.sort()
+    p = lambda f: v[min(len(v) - 1, int(len(v) * f))]
+    return f"{p(0.5):5d} {p(0.9):5d} {p(0.99):5d} {v[-1]:6d}"
+
+
+async def publisher(client, group, n, stop):
+    topic = group.topic.format(n=n)
+    interval = 1000 / group.rate
+    buf = bytearray(group.size[1])
+    await asyncio.sleep_ms(int(random.random() * interval))  # Spread load
+    while not stop:
+        t = ticks_ms()
+        size = random.randint(*group.size) if group.size[0] < group.size[1] else group.size[0]
+        struct.pack_into("!I", buf, 0, t)
+        qos = 1 if random.random() < group.qos1 else 0
+        try:
+            await client.publish(topic, memoryview(buf)[:size], qos=qos)
+        except OSError:
+            pass
+        else:
+            group.pub_ms.append(ticks_diff(ticks_ms(), t))
+            group.pubs += 1
+            group.nbytes += size
+        await asyncio.sleep_ms(max(0, int(interval) - ticks_diff(ticks_ms(), t)))
+
+
+async def main(fname):
+    with open(fname) as f:
+        sc = json.load(f)
+    groups = [Group(g) for g in sc["groups"]]
+    mqtt_as.IBUFSIZE = max(g.size[1] for g in groups) + 100
+    stop = []
+    clients = []
+    tasks = []
+    gc.collect()
+    mem = gc.mem_alloc()
+    t = ticks_ms()
+    n = 0
+    for group in groups:
+        for i in range(group.clients):
+            cfg = dict(config)
+
+            def cb(topic, msg, retained, *_, group=group):
+                group.rx += 1
+                group.e2e_ms.append(ticks_diff(ticks_ms(), struct.unpack_from("!I", msg)[0]))
+
+            async def up(client, group=group):
+                group.connects += 1
+
+            cfg.update(
+                server=sc.get("server", "127.0.0.1"),
+                port=sc.get("port", 0),
+                mqttv5=sc.get("mqttv5", False),
+                client_id=f"load_{group.name}_{i}",
+                subs_cb=cb,
+                connect_coro=up,
+            )
+            client = MQTTClient(cfg)
+            try:
+                await client.connect(quick=True)
+                for topic in group.subscribe:
+                    await client.subscribe(topic, 1)
+            except OSError:
+                group.failed += 1
+                client.close()
+                continue
+            clients.append(client)
+            if group.rate:
+                tasks.append(asyncio.create_task(publisher(client, group, i, stop)))
+            n += 1
+            await asyncio.sleep_ms(max(0, n * 1000 // sc.get("ramp", 50) - ticks_diff(ticks_ms(), t)))
+    gc.collect()
+    mem = (gc.mem_alloc() - mem) // max(len(clients), 1)
+    print(f"{len(clients)} clients connected in {ticks_diff(ticks_ms(), t) / 1000:.1f}s, {mem} bytes per client")
+    for group in groups:  # Discard measurements made during ramp up
+        group.pubs = group.nbytes = group.rx = 0
+        group.pub_ms.clear()
+        group.e2e_ms.clear()
+    secs = sc.get("duration", 30)
+    await asyncio.sleep(secs)
+    stop.append(True)
+    await asyncio.gather(*tasks)
+    for client in clients:
+        await client.disconnect()
+    print(f"{'':49s}{'Publish latency (ms)':^24s} {'End to end latency (ms)':^24s}")
+    print(f"{'Group':12s} Clients  Pub/s  KiB/s   Rx/s Reconn   p50   p90   p99    max   p50   p90   p99    max")
+    for g in groups:
+        row = f"{g.name:12s} {g.clients - g.failed:7d} {g.pubs / secs:6.1f} {g.nbytes / secs / 1024:6.1f} {g.rx / secs:6.1f}"
+        print(row, f"{g.connects - g.clients + g.failed:6d}", percentiles(g.pub_ms), percentiles(g.e2e_ms))
+    print(f"Total: {sum(g.pubs for g in groups) / secs:.1f} pubs/s {sum(g.rx for g in groups) / secs:.1f} msgs/s received")
+
+
+asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else "mqtt_as/tests/perf/scenario.json"))
@@ -0,0 +1,90 @@
+# tests/perf/mixed.py Throughput and latency under mixed publish/subscribe load.
+
+# (C) Copyright Peter Hinch 2026.
+# Released under the MIT licence.
+
+# Several tasks publish concurrently to a topic to which the client is
+# subscribed, so incoming and outgoing traffic contend for the link. One task
+# publishes large qos==1 messages: the reads of these must not stall the small
+# publications. Reports throughput and publish latency, also the time taken
+# to write a ping while the link is busy. Run from the
+# repository root on the unix port against a broker on localhost with
+# micropython mqtt_as/tests/perf/mixed.py [secs] [--loopback]
+# --loopback replaces the network and broker with loopback.py so that the
+# client's own costs are measured.
+
+import sys
+
+sys.path.insert(1, "")  # Repository root
+import fake
+
+fake.install()
+import asyncio
+import mqtt_as
+from time import ticks_ms, ticks_diff
+from mqtt_as import MQTTClient, config
+
+TOPIC = "mixed_test"
+PUBLISHERS = 4  # Tasks publishing small messages
+PERIOD = 5  # ms between publications by each task
+LARGE = 4096  # Size of large messages
+received = [0, 0]  # Messages, bytes
+
+
+def sub_cb(topic, msg, retained):
+    received[0] += 1
+    received[1] += len(msg)
+
+
+async def publisher(client, qos, payload, stats, stop):
+    while not stop:
+        t = ticks_ms()
+        await client.publish(TOPIC, payload, qos=qos)
+        dt = ticks_diff(ticks_ms(), t)
+        stats[0] += 1
+        stats[1] += dt
+        stats[2] = max(stats[2], dt)
+        await asyncio.sleep_ms(PERIOD)
+
+
+async def pinger(client, stats, stop):  # Ping write latency
+    while not stop:
+        await asyncio.sleep_ms(100)
+        t = ticks_ms()
+        await client._ping()
+        stats[2] = max(stats[2], ticks_diff(ticks_ms(), t))
+
+
+async def main(secs, loopback):
+    mqtt_as.IBUFSIZE = LARGE + 100
+    config["server"] = "127.0.0.1"
+    config["subs_cb"] = sub_cb
+    if loopback:
+        from mqtt_as.loopback import Loopback
+
+        config["transport"] = Loopback()
+    client = MQTTClient(config)
+    await client.connect(quick=True)
+    await client.subscribe(TOPIC, 1)
+    stop = []
+    small = [[0, 0, 0] for _ in range(PUBLISHERS)]  # Count, total ms, max ms
+    large = [0, 0, 0]
+    ping = [0, 0, 0]
+    tasks = [asyncio.create_task(publisher(client, n & 1, b"x" * 32, small[n], stop)) for n in range(PUBLISHERS)]
+    tasks.append(asyncio.create_task(publisher(client, 1, b"y" * LARGE, large, stop)))
+    tasks.append(asyncio.create_task(pinger(client, ping, stop)))
+    await asyncio.sleep(secs)
+    stop.append(True)
+    await asyncio.gather(*tasks)
+    await asyncio.sleep(1)  # Allow last messages to arrive
+    await client.disconnect()
+    n = sum(s[0] for s in small)
+    print(f"Small messages: {n / secs:.0f}/s", end=" ")
+    print(f"latency mean {sum(s[1] for s in small) / max(n, 1):.1f}ms max {max(s[2] for s in small)}ms")
+    print(f"Large messages: {large[0] / secs:.1f}/s latency max {large[2]}ms")
+    print(f"Received {received[0] / secs:.0f} msgs/s {received[1] / secs / 1024:.0f} KiB/s")
+    print(f"Ping write latency max {ping[2]}ms")
+
+
+args = [a for a in sys.argv[1:] if not a.startswith("--")]
+asyncio.run(main(int(args[0]) if args else 10, "--loopback" in sys.argv))
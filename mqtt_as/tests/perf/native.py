@@ -0,0 +1,118 @@
+# tests/perf/native.py Parity and speed of the viper/native byte codecs.
+
+# (C) Copyright Peter Hinch 2026.
+# Released under the MIT licence.
+
+# Checks that each function in native.py returns the same result, or raises an
+# exception, in the same cases as the Python version it replaces. This covers
+# boundary values, random values and truncated or out of range input. Then
+# reports the time per call of each version. Run from the repository root on
+# the unix port or a microcontroller with
+# micropython mqtt_as/tests/perf/native.py [calls]
+# The port must have the viper and native emitters.
+
+import sys
+
+sys.path.insert(1, "")  # Repository root
+if sys.implementation.name == "micropython":
+    import fake
+
+    fake.install()
+import mqtt_as  # noqa: F401 Host mode: provides ticks functions
+import random
+from time import ticks_us, ticks_diff
+from mqtt_as import codec, mqtt_v5_properties as props
+
+try:
+    from mqtt_as import native
+except Exception:  # No emitters, or CPython
+    native = None
+
+VBIS = (0, 1, 127, 128, 16383, 16384, 2097151, 2097152, 268435455)
+# (Python version, native.py name)
+NAMES = [(codec.PURE["vbi"], "vbi"), (codec.PURE["_vbi_len"], "vbi_len")]
+NAMES += [(props.PURE[k], k) for k in props.PURE]
+
+
+def call(f, *args):  # Return the result or the exception class.
+    try:
+        r = f(*args)
+    except Exception:
+        return Exception
+    return bytes(r) if isinstance(r, (bytearray, memoryview)) else r
+
+
+def check(name, py, nat, *args):
+    if (a := call(py, *args)) != (b := call(nat, *args)):
+        print(f"FAIL {name}{args}: Python {a} native {b}")
+        return 1
+    return 0
+
+
+def check_vbi(py, nat):  # Encode into buffers of exact size, too small, offset.
+    fails = 0
+    for x in VBIS + tuple(random.getrandbits(28) for _ in range(500)):
+        n = codec.PURE["_vbi_len"](x)
+        for size, offs in ((n, 0), (n + 3, 3), (n - 1, 0), (n + 1, 2)):
+            bp, bn = bytearray(size), bytearray(size)
+            fails += call(py, bp, offs, x) != call(nat, bn, offs, x) or bp != bn
+    return fails
+
+
+def data():  # Random and boundary byte strings for the decoders.
+    yield b""
+    yield b"\xff" * 8
+    yield b"\x80\x80\x80\x80\x01"  # VBI longer than 4 bytes
+    yield b"\x00\x05hello\x00\x00"  # String, truncated string, empty string
+    yield b"\x00\x09short"
+    for _ in range(300):
+        yield bytes(random.getrandbits(8) for _ in range(random.getrandbits(3)))
+        yield bytes(0x20 + random.getrandbits(6) for _ in range(2 + random.getrandbits(4)))
+
+
+def parity():
+    fails = check_vbi(codec.PURE["vbi"], native.vbi)
+    for x in VBIS + (2**28, 2**32 - 1) + tuple(random.getrandbits(32) for _ in range(500)):
+        fails += check("vbi_len", codec.PURE["_vbi_len"], native.vbi_len, x)
+        fails += check("encode_variable_byte_int", props.PURE["encode_variable_byte_int"], native.encode_variable_byte_int, x)
+    for d in data():
+        for k in props.PURE:
+            if k.startswith("decode"):
+                for offs in range(len(d) + 2):
+                    fails += check(k, props.PURE[k], getattr(native, k), d, offs)
+    return fails
+
+
+def bench(f, args, calls):  # Return us per call.
+    t = ticks_us()
+    for _ in range(calls):
+        f(*args)
+    return ticks_diff(ticks_us(), t) / calls
+
+
+def main(calls):
+    if native is None:
+        print("The viper and native emitters are not available: Python versions are in use.")
+        return
+    fails = parity()
+    print("Parity:", "FAIL" if fails else "OK")
+    buf = bytearray(8)
+    args = {
+        "vbi": (buf, 0, 2097152),
+        "vbi_len": (2097152,),
+        "encode_variable_byte_int": (2097152,),
+        "decode_byte": (b"\x01", 0),
+        "decode_two_byte_int": (b"\x01\x02", 0),
+        "decode_four_byte_int": (b"\xff\x01\x02\x03", 0),
+        "decode_variable_byte_int": (b"\x80\x80\x80\x01", 0),
+        "decode_string": (b"\x00\x0ctext/plain;x", 0),
+        "decode_binary": (b"\x00\x08abcdefgh", 0),
+    }
+    print("Function                   Python us  Native us  Speedup")
+    for py, name in NAMES:
+        tp = bench(py, args[name], calls)
+        tn = bench(getattr(native, name), args[name], calls)
+        print(f"{name:26s} {tp:9.2f} {tn:10.2f} {tp / tn:8.1f}")
+
+
+main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,87 @@
+# tests/perf/ram.py RAM use for each combination of client features.
+
+# (C) Copyright Peter Hinch 2026.
+# Released under the MIT licence.
+
+# For each combination of MQTT version, interface, TLS and gateway mode the
+# package is imported afresh and a client connects to a broker on localhost.
+# Reports heap in use (bytes) after import, after instantiation, after
+# connecting and the peak during a 1KiB message round trip. The peak is
+# measured with GC disabled so is an upper bound. Output is a table which
+# may be saved and compared between commits. TLS rows need a TLS broker on
+# port 8883, otherwise they are reported as failed. Run from the repository
+# root on the unix port with
+# micropython mqtt_as/tests/perf/ram.py
+
+import sys
+
+sys.path.insert(1, "")  # Repository root
+import fake
+
+fake.install()
+import asyncio
+import gc
+
+TOPIC = "ram_test"
+PAYLOAD = b"x" * 1024
+
+
+def unload():
+    for name in [k for k in sys.modules if k == "mqtt_as" or k.startswith("mqtt_as.")]:
+        del sys.modules[name]
+
+
+def heap():
+    gc.collect()
+    return gc.mem_alloc()
+
+
+async def measure(v5, events, tls, gateway):
+    unload()
+    base = heap()
+    import mqtt_as
+
+    imp = heap() - base
+    mqtt_as.IBUFSIZE = len(PAYLOAD) + 100
+    got = asyncio.Event()
+    config = mqtt_as.config
+    config.update(server="127.0.0.1", port=8883 if tls else 1883, ssl=tls, mqttv5=v5, gateway=gateway)
+    config["queue_len"] = 1 if events else 0
+    config["subs_cb"] = lambda *_: got.set()
+    client = mqtt_as.MQTTClient(config)
+    inst = heap() - base
+    try:
+        await asyncio.wait_for(client.connect(quick=True), 10)
+        await client.subscribe(TOPIC, 1)
+        conn = heap() - base
+        gc.collect()
+        gc.disable()
+        await client.publish(TOPIC, PAYLOAD, qos=1)
+        if events:
+            async for _ in client.queue:
+                break
+        else:
+            await got.wait()
+        peak = gc.mem_alloc() - base
+        gc.enable()
+        await client.disconnect()
+    except (OSError, asyncio.TimeoutError):
+        gc.enable()
+        client.close()
+        return imp, inst, None, None
+    return imp, inst, conn, peak
+
+
+async def main():
+    print("Ver Interface TLS Gateway   Import    Init Connect    Peak")
+    for v5 in (False, True):
+        for events in (False, True):
+            for tls in (False, True):
+                for gateway in (False, True):
+                    r = await measure(v5, events, tls, gateway)
+                    row = f"{'v5' if v5 else 'v3':3s} {'event' if events else 'callback':9s} {'on' if tls else 'off':3s} {'on' if gateway else 'off':7s}"
+                    print(row, " ".join(f"{x:7d}" if x is not None else "   fail" for x in r))
+                    await asyncio.sleep_ms(200)  # Let tasks of the last client end
+
+
+asyncio.run(main())
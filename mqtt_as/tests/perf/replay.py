@@ -0,0 +1,84 @@
+# tests/perf/replay.py Parser throughput from a capture of broker traffic.
+
+# (C) Copyright Peter Hinch 2026.
+# Released under the MIT licence.
+
+# Feeds a capture (see capture.py) to a client and reports the rate at which
+# incoming messages are processed. With --realtime data is fed at the recorded
+# times and the worst lateness of the client in reading it is reported.
+# Without a capture file a synthetic one is created: a flood of retained qos==1
+# messages, delivered in TCP segments of varying size. No broker is needed. Run from the
+# repository root on the unix port with
+# micropython mqtt_as/tests/perf/replay.py [capture] [--realtime] [--v5]
+# A capture of an application's traffic is made with
+# capture.record(client, "trace.mqc")
+
+import sys
+
+sys.path.insert(1, "")  # Repository root
+if sys.implementation.name == "micropython":
+    import fake
+
+    fake.install()
+import mqtt_as
+from mqtt_as import MQTTClient, config
+from mqtt_as.capture import replay, Recorder, CONNECT, IN
+from mqtt_as.codec import encode, encoded_size
+import asyncio
+from time import ticks_ms, ticks_diff
+
+SYNTH = "/tmp/mqtt_as_synth.mqc"
+MESSAGES = 2000
+SIZE = 200
+received = [0, 0]  # Messages, bytes
+
+
+def sub_cb(topic, msg, retained, *_):
+    received[0] += 1
+    received[1] += len(msg)
+
+
+def synth(fname, v5):  # Write a capture holding a flood of retained messages
+    rec = Recorder(fname)
+    rec.log(CONNECT)
+    rec.log(IN, b"\x20\x03\x00\x00\x00" if v5 else b"\x20\x02\x00\x00")  # CONNACK
+    payload = b"x" * SIZE
+    props = b"\x07\x01\x01\x02\x00\x00\x0e\x10" if v5 else None  # Payload format, expiry
+    data = bytearray()
+    for n in range(MESSAGES):  # PUBLISH qos 1 retained
+        topic = b"flood/%d" % n
+        pkt = bytearray(encoded_size(0x33, n % 65535 + 1, topic, payload, props))
+        encode(pkt, 0, 0x33, n % 65535 + 1, topic, payload, props)
+        data += pkt
+    seg = 0
+    while data:  # Segments do not align with packets
+        seg = seg % 1460 + 137
+        rec.log(IN, data[:seg])
+        data = data[seg:]
+    rec.close()
+
+
+async def main(fname, realtime, v5):
+    if fname is None:
+        fname = SYNTH
+        synth(fname, v5)
+    mqtt_as.IBUFSIZE = 4096
+    config.update(server="127.0.0.1", subs_cb=sub_cb, mqttv5=v5)
+    client = MQTTClient(config)
+    player = replay(client, fname, realtime)
+    t = ticks_ms()
+    await client.connect(quick=True)
+    while not player.done:
+        await asyncio.sleep_ms(10)
+    await asyncio.sleep_ms(100)  # Let the last message be processed
+    dt = ticks_diff(ticks_ms(), t) - 100
+    client.close()
+    print(f"Replayed {player.nbytes} bytes in {dt}ms: {received[0]} messages")
+    print(f"{received[0] * 1000 / dt:.0f} msgs/s {player.nbytes / dt * 1000 / 1024:.0f} KiB/s")
+    if realtime:
+        print(f"Max lag {player.lag}ms")
+
+
+args = sys.argv[1:]
+files = [a for a in args if not a.startswith("--")]
+asyncio.run(main(files[0] if files else None, "--realtime" in args, "--v5" in args))
@@ -0,0 +1,71 @@
+# tests/perf/startup.py Import time and RAM use of each client configuration.
+
+# (C) Copyright Peter Hinch 2026.
+# Released under the MIT licence.
+
+# For each configuration the package is imported afresh and a client is
+# instantiated. Reports the time taken, the heap retained and the modules
+# loaded. Optional features are in separate modules imported only when
+# configured, so the minimal client does not pay for them. Run from the
+# repository root on the unix port with
+# micropython mqtt_as/tests/perf/startup.py
+# Times include compilation: precompiled .mpy files (see tools/mpy_build.py)
+# are much faster.
+
+import sys
+
+sys.path.insert(1, "")  # Repository root
+import fake
+
+fake.install()
+import gc
+import os
+from time import ticks_us, ticks_diff
+
+JOURNAL = "/tmp/mqtt_as_startup"
+CONFIGS = (
+    ("import only", None),
+    ("MQTTv3.1.1", {}),
+    ("MQTTv5", {"mqttv5": True}),
+    ("v5 compression", {"mqttv5": True, "compress": {"": 200}}),
+    ("rate_limits", {"rate_limits": {"": (10, 0)}}),
+    ("journal", {"journal": JOURNAL}),
+    ("dup_cache", {"dup_cache": 16}),
+)
+
+
+def unload():
+    for name in [k for k in sys.modules if k == "mqtt_as" or k.startswith("mqtt_as.")]:
+        del sys.modules[name]
+
+
+def run(name, cfg):
+    unload()
+    gc.collect()
+    mem = gc.mem_alloc()
+    t = ticks_us()
+    import mqtt_as
+
+    client = None
+    if cfg is not None:
+        mqtt_as.config.update(server="127.0.0.1", **cfg)
+        client = mqtt_as.MQTTClient(mqtt_as.config)
+    dt = ticks_diff(ticks_us(), t)
+    gc.collect()
+    mem = gc.mem_alloc() - mem
+    mods = " ".join(k[8:] for k in sorted(sys.modules) if k.startswith("mqtt_as."))
+    print(f"{name:16s} {dt / 1000:7.1f}ms {mem:7d} bytes  {mods}")
+    return client  # Retained until measurement is complete
+
+
+def main():
+    print(f"{'Configuration':16s} {'Time':>9s} {'Heap':>13s}  Modules")
+    for name, cfg in CONFIGS:
+        run(name, cfg)
+    try:
+        os.remove(JOURNAL)
+    except OSError:
+        pass
+
+
+main()
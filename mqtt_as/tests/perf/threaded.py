@@ -0,0 +1,79 @@
+# tests/perf/threaded.py Protocol timing under application CPU load.
+
+# (C) Copyright Peter Hinch 2026.
+# Released under the MIT licence.
+
+# An application task repeatedly blocks the scheduler for longer than the
+# broker allows between packets (1.5 * keepalive), while the client publishes
+# to a topic to which it subscribes. Without threaded.py the client cannot ping
+# and the broker drops it. With it the socket thread pings on the client's
+# behalf. Reports outages, pings sent by the thread and messages echoed for
+# each mode. Requires a broker on localhost which enforces keepalive, such as
+# mosquitto. Run from the repository root on the unix port (which has threads)
+# with
+# micropython mqtt_as/tests/perf/threaded.py [cycles]
+# or under CPython (host mode).
+
+import sys
+
+sys.path.insert(1, "")  # Repository root
+if sys.implementation.name == "micropython":
+    import fake
+
+    fake.install()
+import asyncio
+import mqtt_as
+from time import sleep_ms
+from mqtt_as import MQTTClient, config
+from mqtt_as.threaded import Threaded
+
+TOPIC = "threaded_test"
+KEEPALIVE = 4  # s
+HOG_MS = 2 * KEEPALIVE * 1000  # Application blocks for this long
+
+
+async def conn_han(client):
+    await client.subscribe(TOPIC, 1)
+
+
+async def run(cycles, threaded):  # Return (outages, thread pings, received)
+    count = [0, 0]  # Outages, messages. Handlers are per client.
+
+    def sub_cb(topic, msg, retained):
+        count[1] += 1
+
+    async def wifi_han(state):
+        if not state:
+            count[0] += 1
+
+    config["server"] = "127.0.0.1"
+    config["keepalive"] = KEEPALIVE
+    config["subs_cb"] = sub_cb
+    config["wifi_coro"] = wifi_han
+    config["connect_coro"] = conn_han
+    transport = Threaded() if threaded else None
+    config["transport"] = transport
+    client = MQTTClient(config)
+    await client.connect(quick=True)
+    await asyncio.sleep(1)  # Await subscription
+    for n in range(cycles):
+        await client.publish(TOPIC, f"cycle {n}", qos=1)
+        await asyncio.sleep(1)
+        sleep_ms(HOG_MS)  # Application hogs the CPU
+        await asyncio.sleep(1)
+        await client._connection()  # Await any reconnection
+    pings = transport._stream.pings if threaded else 0
+    result = count[0], pings, count[1]  # Before disconnection
+    await client.disconnect()
+    return result
+
+
+async def main(cycles):
+    print(f"keepalive {KEEPALIVE}s, application blocks for {HOG_MS}ms per cycle, {cycles} cycles")
+    print("Mode      Outages  Thread pings  Echoed")
+    for threaded in (False, True):
+        o, p, r = await run(cycles, threaded)
+        print(f"{'threaded' if threaded else 'normal':9s} {o:7d} {p:13d} {r:7d}")
+
+
+asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 3))
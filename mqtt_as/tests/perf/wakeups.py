@@ -0,0 +1,64 @@
+# tests/perf/wakeups.py Measure client wakeups while idle.
+
+# (C) Copyright Peter Hinch 2026.
+# Released under the MIT licence.
+
+# Compares normal and low power modes. Requires a broker on localhost.
+# Run from the repository root on the unix port with
+# micropython mqtt_as/tests/perf/wakeups.py [seconds]
+# Each scheduler wait issued by the client counts as one wakeup.
+
+import sys
+
+sys.path.insert(1, "")  # Repository root
+import fake
+
+fake.install()
+import asyncio
+import mqtt_as
+from mqtt_as import MQTTClient, config
+
+
+class Counter:  # Proxy for asyncio counting waits issued by mqtt_as
+    def __init__(self):
+        self.n = 0
+
+    def __getattr__(self, name):
+        return getattr(asyncio, name)
+
+    def sleep(self, t):
+        self.n += 1
+        return asyncio.sleep(t)
+
+    def sleep_ms(self, t):
+        self.n += 1
+        return asyncio.sleep_ms(t)
+
+    def wait_for_ms(self, coro, t):
+        self.n += 1
+        return asyncio.wait_for_ms(coro, t)
+
+
+async def measure(secs, low_power):
+    config["server"] = "127.0.0.1"
+    config["low_power"] = low_power
+    client = MQTTClient(config)
+    await client.connect(quick=True)
+    await client.subscribe("foo_topic", 1)
+    counter = Counter()
+    mqtt_as.asyncio = counter
+    await asyncio.sleep(secs)
+    mqtt_as.asyncio = asyncio
+    await client.disconnect()
+    await asyncio.sleep(2)  # Allow ._keep_connected() to quit
+    return counter.n * 60 // secs, client.metrics.get("pings", 0)
+
+
+async def main(secs):
+    print(f"Idle for {secs}s per mode, keepalive {config['keepalive']}s")
+    for lp in (False, True):
+        wpm, pings = await measure(secs, lp)
+        print(f"low_power={str(lp):5} wakeups/min {wpm:6d} pings {pings}")
+
+
+asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 60))
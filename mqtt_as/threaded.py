@@ -0,0 +1,312 @@
+# threaded.py Socket I/O in a second thread for mqtt_as
+
+# (C) Copyright Peter Hinch 2026.
+# Released under the MIT licence.
+
+# Threaded(transport) wraps a transport (by default WiFi, or Socket under
+# CPython) so that each connection's socket is serviced by a thread. On RP2
+# this runs on the second core. On ESP32 threads are pinned to the same core as
+# the scheduler and hold a GIL: the thread is not a separate core but is
+# switched in by the GIL even while an application task blocks. The thread
+# reads and writes the socket and frames incoming packets, exchanging data with
+# the client through two lock free ring buffers. Received packets are passed to the client when
+# complete, so the client never waits on the network part way through one.
+# The thread also keeps the connection alive: if the client writes nothing for
+# half the keepalive time, for example because application tasks are hogging
+# the CPU, the thread sends a PINGREQ. It records the time of receipt in the
+# client's .last_rx so that the replies prove the broker is alive although the
+# client has not yet read them. Acknowledgements are still sent by the client
+# once a message has been processed. TLS is not supported.
+# Only one thread runs at a time. If a connection is opened while the thread is
+# still closing the last, the thread services the new one next, so the client
+# never waits for it. A stream reports "would block" until the thread has
+# taken it over. Once data flow, the thread allocates only small memoryview
+# objects per socket read or write; when idle it does not allocate.
+
+import _thread
+import asyncio
+from time import sleep_ms, ticks_ms, ticks_diff
+from . import HOST, BUSY_ERRORS
+from .transport import Socket
+
+POLL_MS = 2  # Thread sleep when the socket is idle (ms)
+
+
+_PING = b"\xc0\x00"
+
+
+# Byte buffer with one producer and one consumer, which run in different
+# threads. It needs no lock because:
+# 1. Each index is written by one side only: wi by the producer, ri by the
+#    consumer. An index is a small int, so is stored in one machine word and
+#    never seen part written.
+# 2. The producer writes data before advancing wi past them; the consumer reads
+#    wi before reading the data it covers. Likewise the consumer copies data
+#    out before advancing ri, and the producer reads ri before overwriting.
+# 3. These stores become visible to the other thread in program order. With a
+#    GIL (ESP32) a thread switch orders them; on RP2 (no GIL) the cores are in
+#    order, with no cache in front of SRAM, so stores are seen in order.
+# Each side reads the other's index once per operation (into a local).
+class Ring:
+    def __init__(self, size):
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.size = size
+        self.wi = 0  # Written by the producer
+        self.ri = 0  # Written by the consumer
+
+    def free(self, i):  # No. of contiguous free bytes from index i (producer).
+        ri = self.ri
+        return (ri - 1 if ri > i else self.size - (ri == 0)) - i
+
+    def data(self):  # No. of contiguous bytes of data from ri (consumer).
+        wi = self.wi
+        ri = self.ri
+        return (wi if wi >= ri else self.size) - ri
+
+
+class _Framer:  # Tracks packet boundaries in a byte stream.
+    def __init__(self):
+        self.idle = True  # Between packets
+        self._len = False  # Reading Remaining Length
+        self._sz = 0
+        self._sh = 0
+
+    # Consume data[offs:end]. Return the offset at which the current packet
+    # ends, or end. .idle is then True if the packet is complete.
+    def scan(self, data, offs, end):
+        while offs < end:
+            if self.idle:
+                self.idle = False
+                self._len = True
+                self._sz = self._sh = 0
+                offs += 1
+            elif self._len:
+                b = data[offs]
+                offs += 1
+                self._sz |= (b & 0x7F) << self._sh
+                self._sh += 7
+                if not b & 0x80:
+                    self._len = False
+                    if not self._sz:
+                        self.idle = True
+                        return offs
+            else:
+                n = min(self._sz, end - offs)
+                self._sz -= n
+                offs += n
+                if not self._sz:
+                    self.idle = True
+                    return offs
+        return offs
+
+
+class _Stream:  # The client's end of a connection serviced by a thread.
+    def __init__(self, owner):
+        self._rx = owner._rx
+        self._tx = owner._tx
+        self._client = owner._client
+        self.flag = owner._flag  # Set by the thread when data arrive
+        self.ready = False  # Set by the thread when it owns the rings
+        self.closing = False  # Set by the client
+        self.pings = 0  # PINGREQs sent by the thread
+        self._eof = False
+        self._err = None
+
+    def close(self):
+        self.closing = True
+
+    def readinto(self, buf, n=None):
+        if not self.ready:
+            return None
+        n = n or len(buf)
+        eof = self._eof  # Read first: data precede the flag
+        rx = self._rx
+        got = 0
+        while got < n and (k := rx.data()):
+            k = min(k, n - got)
+            ri = rx.ri
+            buf[got : got + k] = rx.mv[ri : ri + k]
+            rx.ri = (ri + k) % rx.size
+            got += k
+        if got or not eof:
+            return got or None
+        if self._err is not None:
+            raise self._err
+        return 0
+
+    def read(self, n):  # Used in low power mode.
+        buf = bytearray(n)
+        if (k := self.readinto(buf)) is None:
+            return None
+        return bytes(buf[:k])
+
+    def write(self, buf, off=0, n=None):
+        if self._eof:
+            raise self._err or OSError(-1, "Connection closed by host")
+        if not self.ready:
+            return None
+        n = len(buf) - off if n is None else n
+        mv = memoryview(buf)
+        tx = self._tx
+        put = 0
+        while put < n and (k := tx.free(wi := tx.wi)):
+            k = min(k, n - put)
+            tx.mv[wi : wi + k] = mv[off + put : off + put + k]
+            tx.wi = (wi + k) % tx.size
+            put += k
+        return put or None
+
+    def _write(self, sock, buf, off, n):  # Return bytes written.
+        try:
+            return sock.write(buf, off, n) or 0
+        except OSError as e:
+            if e.args[0] not in BUSY_ERRORS:
+                raise
+        return 0
+
+    def _read(self, sock, buf):  # Return bytes read, 0 on EOF, None if none.
+        try:
+            return sock.readinto(buf)
+        except OSError as e:
+            if e.args[0] not in BUSY_ERRORS:
+                raise
+        return None
+
+    # Runs in a thread. smv is a memoryview of scratch.
+    def pump(self, sock, scratch, smv):
+        rx, tx = self._rx, self._tx
+        rx.wi = rx.ri = tx.wi = tx.ri = 0  # The client awaits .ready
+        self.ready = True
+        rxf, txf = _Framer(), _Framer()
+        pi = 0  # Index in rx of data not yet passed to the client
+        o = n = 0  # Unprocessed data in scratch
+        ping = -1  # Offset of unsent part of a PINGREQ. -1: none
+        t_tx = None  # Time of last write. None: nothing written
+        try:
+            while not self.closing:
+                busy = False
+                if o < n and (f := rx.free(pi)):  # Copy a packet, or part of one
+                    e = rxf.scan(scratch, o, min(n, o + f))
+                    rx.mv[pi : pi + e - o] = smv[o:e]
+                    pi = (pi + e - o) % rx.size
+                    o = e
+                    if rxf.idle or not rx.free(pi):  # Complete, or too long for rx
+                        rx.wi = pi
+                        self.flag.set()
+                    busy = True
+                elif o >= n:
+                    if (k := self._read(sock, scratch)) == 0:
+                        break  # Closed by host
+                    if k is not None:
+                        o, n = 0, k
+                        self._client.last_rx = ticks_ms()  # Broker is alive
+                        busy = True
+                if ping < 0 and txf.idle and t_tx is not None:
+                    if ticks_diff(ticks_ms(), t_tx) >= 2 * self._client._ping_interval:
+                        ping = 0  # Client is late: ping for it
+                        self.pings += 1
+                if ping >= 0:
+                    if k := self._write(sock, _PING, ping, 2 - ping):
+                        ping = -1 if ping + k >= 2 else ping + k
+                        t_tx = ticks_ms()
+                        busy = True
+                elif d := tx.data():
+                    ri = tx.ri
+                    if k := self._write(sock, tx.buf, ri, d):
+                        e = ri
+                        while e < ri + k:
+                            e = txf.scan(tx.buf, e, ri + k)
+                        tx.ri = (ri + k) % tx.size
+                        t_tx = ticks_ms()
+                        busy = True
+                if not busy:
+                    sleep_ms(POLL_MS)
+        except OSError as e:
+            self._err = e
+        finally:
+            try:
+                sock.close()
+            except OSError:
+                pass
+            self._eof = True
+            self.flag.set()
+
+
+class _Reader:  # Awaits data from the thread.
+    def __init__(self, stream):
+        self._stream = stream
+
+    async def read(self, n):
+        while (r := self._stream.read(n)) is None:
+            await self._stream.flag.wait()
+        return r
+
+
+class Threaded:
+    # transport: the link to use. Defaults are as for config["transport"].
+    # rxbuf, txbuf: sizes of the ring buffers. Received packets larger than
+    # rxbuf are passed to the client in parts.
+    def __init__(self, transport=None, rxbuf=1024, txbuf=512):
+        if transport is None:
+            from .transport import WiFi
+
+            transport = Socket() if HOST else WiFi()
+        self._transport = transport
+        self.nic = transport.nic
+        self._rx = Ring(rxbuf)
+        self._tx = Ring(txbuf)
+        self._scratch = bytearray(256)  # Socket reads
+        self._smv = memoryview(self._scratch)
+        self._flag = asyncio.ThreadSafeFlag()
+        self._lock = _thread.allocate_lock()  # Protects ._next and ._running
+        self._next = None  # (stream, socket) awaiting the thread
+        self._running = False  # Thread is running
+        self._client = None
+        self._stream = None
+
+    async def up(self, client, quick):
+        if client._ssl:
+            raise ValueError("TLS is not supported by Threaded.")
+        self._client = client
+        await self._transport.up(client, quick)
+
+    def down(self):
+        self._transport.down()
+
+    def close(self):
+        self._transport.close()
+
+    def isconnected(self):
+        return self._transport.isconnected()
+
+    def dns(self):
+        return self._transport.dns()
+
+    def open(self, addr):
+        sock = self._transport.open(addr)
+        if (s := self._stream) is not None:
+            s.closing = True
+        self._stream = s = _Stream(self)
+        with self._lock:
+            if self._running:  # Closing the last stream: it will take this one
+                if (n := self._next) is not None:  # Superseded before use
+                    n[1].close()
+                self._next = (s, sock)
+                return s
+            self._running = True
+        _thread.start_new_thread(self._run, (s, sock))
+        return s
+
+    def _run(self, stream, sock):  # Thread: service streams until none waits.
+        while True:
+            stream.pump(sock, self._scratch, self._smv)
+            with self._lock:
+                if self._next is None:
+                    self._running = False
+                    return
+                stream, sock = self._next
+                self._next = None
+
+    def reader(self, stream):
+        return _Reader(stream)
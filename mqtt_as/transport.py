@@ -0,0 +1,86 @@
+# transport.py Links between mqtt_as and the broker
+
+# (C) Copyright Peter Hinch 2026.
+# Released under the MIT licence.
+
+# A transport brings a link up, reports its state and opens connections to the
+# broker. The client uses config["transport"]: by default a WiFi instance, or
+# Socket under CPython where the OS manages the network. Methods:
+# async up(client, quick) Bring the link up. Raise OSError on failure.
+# down() Take the link down after an outage so that recovery starts afresh.
+# close() Shut down the interface. May raise OSError.
+# isconnected() Return the state of the link.
+# dns() Return the DNS server provided by the link (DHCP) or None.
+# open(addr) Return a nonblocking stream connected, or connecting, to addr.
+# reader(stream) Return an object whose .read(n) coroutine awaits data on the
+# stream, returning b"" if the connection has closed. Used in low power mode.
+# A stream has MicroPython's stream methods readinto(buf, n), write(buf, off,
+# n) and close(). readinto and write return None if they would block. readinto
+# returns 0 if the connection has closed. See loopback.py for an example.
+
+import asyncio
+from . import socket, StreamReader, BUSY_ERRORS
+
+
+class Socket:  # No link management: wired Ethernet, unix port.
+    # nic: optional interface such as network.LAN whose state is monitored.
+    def __init__(self, nic=None):
+        self.nic = nic
+
+    async def up(self, client, quick):
+        if (nic := self.nic) is None:
+            return
+        nic.active(True)
+        for _ in range(60):  # Await link and DHCP lease. Check once per sec.
+            if nic.isconnected():
+                return
+            await asyncio.sleep(1)
+        raise OSError("Link timed out")
+
+    def down(self):  # A wired link is left up.
+        pass
+
+    def close(self):
+        if self.nic is not None:
+            self.nic.active(False)
+
+    def isconnected(self):
+        return self.nic is None or self.nic.isconnected()
+
+    def dns(self):
+        return None if self.nic is None else self.nic.ifconfig()[3]
+
+    def open(self, addr):
+        sock = socket.socket()
+        sock.setblocking(False)
+        try:
+            sock.connect(addr)
+        except OSError as e:
+            if e.args[0] not in BUSY_ERRORS:
+                raise
+        return sock
+
+    def reader(self, stream):
+        return StreamReader(stream)
+
+
+class WiFi(Socket):  # Station interface. See wifi.py.
+    def __init__(self):
+        import network
+
+        super().__init__(network.WLAN(network.STA_IF))
+        self.nic.active(True)
+
+    async def up(self, client, quick):
+        from .wifi import wifi_connect
+
+        await wifi_connect(client, self.nic, quick)
+
+    def down(self):
+        self.nic.disconnect()
+
+    def close(self):
+        try:
+            self.nic.disconnect()  # Disconnect Wi-Fi to avoid errors
+        finally:
+            self.nic.active(False)
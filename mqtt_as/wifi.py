@@ -0,0 +1,89 @@
+# wifi.py WiFi connection for mqtt_as
+
+# (C) Copyright Peter Hinch 2017-2026.
+# Released under the MIT licence.
+
+# Platform specific code to bring up the station interface, and to set up
+# ESPNow for the gateway. Imported when first needed so that applications
+# which never connect (or which use another transport) do not pay for
+# compiling it.
+
+import asyncio
+import network
+from . import ESP8266, ESP32, RP2, PYBOARD
+
+
+async def wifi_connect(client, s, quick):  # s: station interface
+    if ESP8266:
+        if s.isconnected():  # 1st attempt, already connected.
+            return
+        s.active(True)
+        s.connect()  # ESP8266 remembers connection.
+        for _ in range(60):
+            # Break out on fail or success. Check once per sec.
+            if s.status() != network.STAT_CONNECTING:
+                break
+            await asyncio.sleep(1)
+        # might hang forever awaiting dhcp lease renewal or something else
+        if s.status() == network.STAT_CONNECTING:
+            s.disconnect()
+            await asyncio.sleep(1)
+        if not s.isconnected() and client._ssid is not None and client._wifi_pw is not None:
+            s.connect(client._ssid, client._wifi_pw)
+            # Break out on fail or success. Check once per sec.
+            while s.status() == network.STAT_CONNECTING:
+                await asyncio.sleep(1)
+    else:
+        s.active(True)
+        if RP2:  # Disable auto-sleep.
+            # https://datasheets.raspberrypi.com/picow/connecting-to-the-internet-with-pico-w.pdf
+            # para 3.6.3
+            s.config(pm=0xA11140)
+        s.connect(client._ssid, client._wifi_pw)
+        for _ in range(60):  # Break out on fail or success. Check once per sec.
+            await asyncio.sleep(1)
+            # Loop while connecting or no IP
+            if s.isconnected():
+                break
+            if ESP32:
+                # Status values >= STAT_IDLE can occur during connect:
+                # STAT_IDLE 1000, STAT_CONNECTING 1001, STAT_GOT_IP 1010
+                # Error statuses are in range 200..204
+                if s.status() < network.STAT_IDLE:
+                    # pause as workaround to avoid persistent reconnect failures
+                    # see https://github.com/peterhinch/micropython-mqtt/issues/132 for details
+                    await asyncio.sleep(1)
+                    break
+            elif PYBOARD:  # No symbolic constants in network
+                if not 1 <= s.status() <= 2:
+                    break
+            elif RP2:  # 1 is STAT_CONNECTING. 2 reported by user (No IP?)
+                if not 1 <= s.status() <= 2:
+                    break
+        else:  # Timeout: still in connecting state
+            s.disconnect()
+            await asyncio.sleep(1)
+
+    if not s.isconnected():  # Timed out
+        raise OSError("Wi-Fi connect timed out")
+    if not quick:  # Skip on first connection only if power saving
+        # Ensure connection stays up for a few secs.
+        client.dprint("Checking WiFi integrity.")
+        for _ in range(5):
+            if not s.isconnected():
+                raise OSError("Connection Unstable")  # in 1st 5 secs
+            await asyncio.sleep(1)
+        client.dprint("Got reliable connection")
+
+
+def espnow(sta):  # Called from gateway (hence ESP32). Return an ESPNow instance.
+    import time
+    import aioespnow
+
+    while not sta.active():
+        time.sleep(0.1)
+    sta.config(pm=sta.PM_NONE)  # No power management
+    sta.active(True)
+    e = aioespnow.AIOESPNow()  # Returns AIOESPNow enhanced with async support
+    e.active(True)
+    return e
@@ -0,0 +1,65 @@
+#! /usr/bin/env python3
+# mpy_build.py Cross compile mqtt_as for installation as bytecode.
+
+# (C) Copyright Peter Hinch 2026.
+# Released under the MIT licence.
+
+# Compiling mqtt_as on the target needs a large contiguous block of RAM and
+# takes several seconds: on ESP8266 it is impossible. This script runs on the
+# host. It compiles each module listed in the repository's package.json with
+# mpy-cross and writes the results, together with a package.json listing
+# them, to a directory (default mpy). Files not in the mqtt_as package (such
+# as mqtt_local_example.py) are copied as source so that they can be edited.
+# Viper and native code can only be compiled for a given architecture: without
+# -march native.py is copied as source, to be compiled on the target where its
+# emitters are available.
+# The .mpy files must be built with the mpy-cross matching the target firmware
+# version. Copy the mpy/mqtt_as directory to the target's /lib, or host the
+# output directory and install with mip.
+# Usage:
+# $ python3 tools/mpy_build.py [-o mpy] [-march=xtensawin] [-O2] [--mpy-cross PATH]
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NATIVE = ("mqtt_as/native.py",)  # Need -march
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Cross compile mqtt_as.")
+    ap.add_argument("-o", "--output", default=os.path.join(ROOT, "mpy"), help="output directory")
+    ap.add_argument("--mpy-cross", default="mpy-cross", help="mpy-cross executable")
+    args, opts = ap.parse_known_args()  # Others (-march, -O) go to mpy-cross
+    with open(os.path.join(ROOT, "package.json")) as f:
+        pkg = json.load(f)
+    urls = []
+    march = any(o.startswith("-march") for o in opts)
+    for dest, _ in pkg["urls"]:
+        src = os.path.join(ROOT, dest)
+        if dest.startswith("mqtt_as/") and dest.endswith(".py") and (march or dest not in NATIVE):
+            dest = dest[:-3] + ".mpy"
+            out = os.path.join(args.output, dest)
+            os.makedirs(os.path.dirname(out), exist_ok=True)
+            cmd = [args.mpy_cross, *opts, "-s", os.path.basename(src), "-o", out, src]
+            try:
+                if subprocess.run(cmd).returncode:
+                    sys.exit(f"Failed to compile {src}")
+            except FileNotFoundError:
+                sys.exit(f"{args.mpy_cross} not found. It may be installed with pip install mpy-cross")
+        else:
+            out = os.path.join(args.output, dest)
+            os.makedirs(os.path.dirname(out), exist_ok=True)
+            shutil.copy(src, out)
+        urls.append([dest, dest])  # URL relative to package.json
+        print(f"{dest:32s} {os.path.getsize(out):6d} bytes")
+    with open(os.path.join(args.output, "package.json"), "w") as f:
+        json.dump({"urls": urls, "version": pkg["version"]}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()